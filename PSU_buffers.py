@@ -0,0 +1,154 @@
+##########################################################################################################
+#
+# python PSU_buffers.py [--buffers km|percent ...] [--country COUNTRY_STRING ...]
+#
+# This script creates the percent-area and fixed-distance buffers around the PSU polygons of the four
+# countries and saves them to shapefiles, replacing the ArcGIS/PSU_buffers.ipynb notebook.
+#
+# Depending on the arguments provided to the script in the command line, the script creates:
+#
+# 	no arguments: both the fixed-distance and the percent-area buffers
+#
+#	--buffers km: only the fixed-distance buffers
+#
+#	--buffers percent: only the percent-area buffers
+#
+# If countries are provided with the --country argument, only those countries are processed.
+#
+# The buffers are computed in a Lambert azimuthal equal-area projection centred on each country, so that
+# both the buffer distances and the polygon areas are preserved, and saved in the CRS of the PSU polygons.
+#
+##########################################################################################################
+
+import sys
+import numpy as np
+import geopandas as gpd
+import shapely
+
+country_codes={'kenya': 'KEN', 'nigeria': 'NIG', 'ethiopia': 'ETH', 'southafrica': 'SAF'}
+
+# Lists of buffers
+percents=[200,300,400,500,750,1000]
+kms=[1,2,5,10,20,50]
+
+quad_segs=8 # Segments used to approximate a quarter circle
+bisect_iter=40 # Bisection steps used to solve the percent-area buffer distances
+area_rtol=1e-4 # Relative tolerance on the buffered area
+bound_margin=1.1 # Margin on the upper bound of the percent-area buffer distances
+
+def equal_area_crs(geometry):
+	'''
+	Returns a Lambert azimuthal equal-area CRS centred on the given GeoSeries.
+	'''
+
+	min_x, min_y, max_x, max_y = geometry.to_crs(epsg=4326).total_bounds
+	lon=(min_x+max_x)/2
+	lat=(min_y+max_y)/2
+
+	return '+proj=laea +lat_0='+str(lat)+' +lon_0='+str(lon)+' +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs'
+
+def distance_buffers(geoms, km):
+	'''
+	Buffers the (projected, metre-based) geometries by a fixed distance in km.
+	'''
+
+	return shapely.buffer(geoms, km*1000, quad_segs=quad_segs)
+
+def percent_distances(geoms, percent):
+	'''
+	Solves, for all the geometries at once, the buffer distance at which the area of the buffered
+	geometry is the given percentage of the area of the original one. Each bisection step only buffers the
+	geometries that have not converged yet, and each geometry gets the first distance within area_rtol.
+	'''
+
+	ratio=percent/100
+	areas=shapely.area(geoms)
+	target=areas*ratio
+
+	# By the Brunn-Minkowski inequality, no buffer grows more slowly than that of a disc with the same area,
+	# so the disc solution is an upper bound of the distance. The buffers approximated with quad_segs segments
+	# are slightly smaller than the true ones, so the bound is widened, and doubled until it brackets the target
+	low=np.zeros(len(geoms))
+	high=bound_margin*(np.sqrt(ratio)-1)*np.sqrt(areas/np.pi)
+
+	short=np.arange(len(geoms))
+	for i in range(0,bisect_iter):
+		short=short[shapely.area(shapely.buffer(geoms[short], high[short], quad_segs=quad_segs))<target[short]]
+		if(len(short)==0):
+			break
+		high[short]*=2
+
+	distances=(low+high)/2
+	active=np.arange(len(geoms))
+
+	for i in range(0,bisect_iter):
+
+		mid=(low[active]+high[active])/2
+		mid_areas=shapely.area(shapely.buffer(geoms[active], mid, quad_segs=quad_segs))
+		distances[active]=mid
+
+		too_big=mid_areas>target[active]
+		high[active]=np.where(too_big, mid, high[active])
+		low[active]=np.where(too_big, low[active], mid)
+
+		active=active[np.abs(mid_areas-target[active])>area_rtol*target[active]]
+		if(len(active)==0):
+			break
+
+	return distances
+
+def percent_buffers(geoms, percent):
+	'''
+	Buffers the (projected, metre-based) geometries so that each has the given percentage of its original area.
+	'''
+
+	buffers=shapely.buffer(geoms, percent_distances(geoms, percent), quad_segs=quad_segs)
+
+	# Checking the area ratios of the buffers
+	areas=shapely.area(geoms)
+	ratios=shapely.area(buffers)[areas>0]/areas[areas>0]
+	off=np.abs(ratios-percent/100)>area_rtol*percent/100
+
+	if(off.any()):
+		print('Warning:', np.count_nonzero(off), 'buffers of', percent, 'percent off by more than', area_rtol,
+			'(max relative error: %.2e)' % np.max(np.abs(ratios/(percent/100)-1)))
+
+	return buffers
+
+def country_buffers(country, km_buffer=True, percent_buffer=True):
+	'''
+	Creates and saves all the requested buffer shapefiles of a country.
+	'''
+
+	country_code=country_codes[country]
+	buff_folder='GIS/'+country_code+'/'
+
+	psus=gpd.read_file(buff_folder+country_code+'_R8_PSU_polys.shp')
+	source_crs=psus.crs
+
+	laea=equal_area_crs(psus.geometry)
+	geoms=psus.geometry.to_crs(laea).values
+
+	buffer_sets=dict()
+
+	if(km_buffer):
+		for km in kms:
+			buffer_sets[str(km)+'km']=distance_buffers(geoms, km)
+
+	if(percent_buffer):
+		for percent in percents:
+			buffer_sets[str(percent)]=percent_buffers(geoms, percent)
+
+	for buffer_str, buffer_geoms in buffer_sets.items():
+
+		buffers=psus.drop(columns='geometry')
+		buffers=gpd.GeoDataFrame(buffers, geometry=gpd.GeoSeries(buffer_geoms, crs=laea).to_crs(source_crs))
+
+		buffers.to_file(buff_folder+country_code+'_R8_PSU_'+buffer_str+'_buffers.shp')
+
+		print(country, buffer_str)
+
+if __name__ == '__main__':
+
+	import cli
+	cli.main(['buffers']+sys.argv[1:])
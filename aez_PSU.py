@@ -0,0 +1,111 @@
+##########################################################################################################
+#
+# python aez_PSU.py [--centroids] [--country COUNTRY_STRING ...]
+#
+# This script assigns each PSU to the ecological zone it falls in and writes the result to a CSV file,
+# replacing the spatial join that was previously carried out by hand in a GIS software.
+#
+# The ecological zone polygons (Ecological_areas/[COUNTRY_ACRONYM]/mst_thz_[COUNTRY_STRING]_poly.shp) are
+# indexed once in an STRtree, which is then queried with all the PSUs of a country in a single call.
+# Depending on the arguments provided to the script in the command line, the PSUs are represented by:
+#
+# 	no arguments: the PSU polygons; where a polygon straddles a zone boundary, the zone with the
+#	largest overlap is chosen
+#
+#	--centroids: the PSU centroids
+#
+# PSUs that do not intersect any zone (e.g. on the coastline) are assigned the nearest zone.
+# If countries are provided with the --country argument, only those countries are processed.
+#
+##########################################################################################################
+
+import sys
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import psu_store
+
+country_codes={'kenya': 'KEN', 'nigeria': 'NIG', 'ethiopia': 'ETH', 'southafrica': 'SAF'}
+
+equal_area_crs='EPSG:6933' # Used to compare the overlap areas
+
+def join_zones(psu_geoms, zone_geoms, centroids=False):
+	'''
+	Returns, for each PSU geometry, the positional index of the zone geometry it falls in.
+	Both geometry arrays must be in the same (preferably equal-area) CRS.
+	'''
+
+	psu_geoms=np.asarray(psu_geoms)
+	zone_geoms=np.asarray(zone_geoms)
+	psu_num=len(psu_geoms)
+
+	tree=shapely.STRtree(zone_geoms)
+
+	zone_index=np.full(psu_num, -1, dtype=np.int64)
+
+	if(centroids):
+		points=shapely.centroid(psu_geoms)
+		psu_idx, zone_idx = tree.query(points, predicate='intersects')
+
+		# A centroid on a shared boundary intersects two zones: the first match is kept
+		first=np.unique(psu_idx, return_index=True)[1]
+		zone_index[psu_idx[first]]=zone_idx[first]
+	else:
+		points=None
+		psu_idx, zone_idx = tree.query(psu_geoms, predicate='intersects')
+
+		# Overlap area of every intersecting (PSU, zone) pair
+		areas=shapely.area(shapely.intersection(psu_geoms[psu_idx], zone_geoms[zone_idx]))
+
+		# Sorting by PSU and by decreasing area, the first pair of each PSU is the largest overlap
+		order=np.lexsort((-areas, psu_idx))
+		psu_idx=psu_idx[order]
+		zone_idx=zone_idx[order]
+
+		first=np.unique(psu_idx, return_index=True)[1]
+		zone_index[psu_idx[first]]=zone_idx[first]
+
+	# PSUs falling outside all the zones are assigned the nearest one
+	missing=np.flatnonzero(zone_index<0)
+
+	if(len(missing)>0):
+		if(points is None):
+			points=shapely.centroid(psu_geoms)
+		near_psu, near_zone = tree.query_nearest(points[missing], all_matches=False)
+		zone_index[missing[near_psu]]=near_zone
+
+	return zone_index
+
+def country_aez(country, centroids=False):
+	'''
+	Returns a dataframe with the ecological zone (AEZ_Num) of each PSU (EA_Num) of a country.
+	'''
+
+	country_code=country_codes[country]
+
+	psus=psu_store.load('GIS/'+country_code+'/'+country_code+'_R8_PSU_polys', columns=[]).reset_index().to_crs(equal_area_crs)
+	zones=gpd.read_file('Ecological_areas/'+country_code+'/mst_thz_'+country+'_poly.shp').to_crs(equal_area_crs)
+
+	zone_index=join_zones(psus.geometry.values, zones.geometry.values, centroids=centroids)
+
+	aez_df=pd.DataFrame({'EA_Num': psus['EA_Num'].astype('int64')})
+	aez_df['AEZ_Num']=zones['gridcode'].to_numpy()[zone_index]
+
+	return aez_df
+
+def run(countries, centroids=False):
+
+	# Looping over the countries
+	for country in countries:
+
+		print(country)
+
+		aez_df=country_aez(country, centroids=centroids)
+
+		aez_df.to_csv('Afrobarometer/'+country_codes[country]+'/'+country+'_AEZ_PSU.csv')
+
+if __name__ == '__main__':
+
+	import cli
+	cli.main(['aez']+sys.argv[1:])
@@ -1,14 +1,25 @@
 ##########################################################################################################
 #
+# python afrobarometer.py [--country COUNTRY_STRING ...] [--ea-table]
+#
 # This script extracts the Afrobarometer outcome and explanatory variables from the raw data,
 # ensures they only have valid values (masking the invalid ones) and writes the result to a CSV file.
+# If countries are provided with the --country argument, only those countries are processed.
+#
+# With the --ea-table argument, it instead aggregates the respondents of the existing respondent CSV file to
+# their PSUs (EA_Num) in the Afrobarometer/[COUNTRY_ACRONYM]/[COUNTRY_STRING]_EA_agg.csv file: the number of
+# respondents, the sum of the HH_weight weights, the weighted shares of the outcomes (see the OUTCOME_CODE
+# glossary in the README) and the mean of the explanatory variables of each PSU, joined to the PSU level
+# variables already computed (see psu_files). The respondents of the PSU are the rows Resp_start to Resp_end
+# (excluded) of the [COUNTRY_STRING]_EA_index.csv file, which maps each respondent (Row of the respondent CSV
+# files) to its PSU. Run it once the PSU level variables are computed (the ea_table stage of pipeline.py).
 # 
 ##########################################################################################################
 
+import os
+import sys
 import numpy as np
 import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
 
 # Countries, acronyms and Afrobarometer Excel data files
 
@@ -400,6 +411,16 @@ other_cols=[
     "GPS Longitude in EA",
 ]
 
+# Outcome variables and values for which they are set to 1 (as in the R scripts)
+
+outcome_values={'Q54aF': [1,2], 'Q54aE': [2], 'Q54bF': [1,2], 'Q54bE': [2], 'Q54cF': [1,2], 'Q54cE': [2]}
+
+# PSU level variables joined to the PSU aggregates and columns that are not explanatory variables
+
+psu_files=['_vars_PSU_poly_2.csv', '_Urb_Rur.csv', '_AEZ_PSU.csv']
+
+non_covariates=['Respondent', 'EA_Num', 'EA_weight', 'HH_weight', 'Latitude', 'Longitude', 'Q54a', 'Q54b', 'Q54c'] # As in miss_forest.R
+
 # Ethnic Power Relations rankings
 
 epr_dict={'kenya': {
@@ -511,9 +532,9 @@ valid_values["Q96c"]=[0,1]
 valid_values["Q97"]=[0,1,2,3,4,5,6,7,8,9]
 valid_values["Q98b"]=[0,1,2,3]
 
-# Looping through the countries
+# Processing of the data of a single country
 
-for country in countries:
+def process_country(country):
 
 	folder='Afrobarometer/'+country_acronyms[country]+'/'
 
@@ -594,3 +615,68 @@ for country in countries:
 	# Saving the data to a CSV
 
 	db1.to_csv(folder+country+'_afrob_vars.csv')
+
+def ea_table(country):
+	'''
+	Aggregates the respondents of the country to their PSUs, in a single pass over the factorized EA_Num
+	codes, and saves the PSU table and the respondent to PSU index. The non-imputed answers of _afrob_vars.csv
+	are aggregated (the missing ones are left out of the shares and means), so that the table does not depend
+	on the imputation of miss_forest.R, whose _afrob_imp.csv file is used by the models.
+	'''
+
+	folder='Afrobarometer/'+country_acronyms[country]+'/'
+
+	resp_df=pd.read_csv(folder+country+'_afrob_vars.csv', index_col=0)
+	resp_df=resp_df.loc[resp_df['EA_Num'].notna()]
+
+	codes, ea_nums = pd.factorize(resp_df['EA_Num'].astype('int64'), sort=True)
+	ea_num=len(ea_nums)
+
+	# Respondents sorted by PSU, so that each PSU is a contiguous range
+
+	order=np.argsort(codes, kind='stable')
+	counts=np.bincount(codes, minlength=ea_num)
+	ends=np.cumsum(counts)
+
+	ea_df=pd.DataFrame({'Respondents': counts, 'Resp_start': ends-counts, 'Resp_end': ends}, index=pd.Index(ea_nums, name='EA_Num'))
+
+	weights=resp_df['HH_weight'].fillna(0).to_numpy(dtype=float)
+	ea_df['HH_weight']=np.bincount(codes, weights=weights, minlength=ea_num)
+
+	# Weighted shares of the outcomes
+
+	for outcome, values in outcome_values.items():
+		answers=resp_df[outcome[:-1]].to_numpy(dtype=float)
+		valid=~np.isnan(answers)
+		ea_df[outcome]=np.bincount(codes, weights=weights*np.isin(answers, values), minlength=ea_num)/np.bincount(codes, weights=weights*valid, minlength=ea_num)
+
+	# Means of the explanatory variables, all reduced at once over the (PSU, variable) pairs
+
+	covariates=[col for col in resp_df.columns if col not in non_covariates]
+	values=resp_df.loc[:,covariates].to_numpy(dtype=float)
+	valid=~np.isnan(values)
+
+	pair_codes=(codes[:,None]*len(covariates)+np.arange(len(covariates))).ravel()
+	sums=np.bincount(pair_codes, weights=np.where(valid, values, 0).ravel(), minlength=ea_num*len(covariates))
+	valid_counts=np.bincount(pair_codes, weights=valid.ravel(), minlength=ea_num*len(covariates))
+
+	means=(sums/valid_counts).reshape(ea_num, len(covariates))
+	ea_df=ea_df.join(pd.DataFrame(means, index=ea_df.index, columns=[col+'_mean' for col in covariates]))
+
+	# Joining the PSU level variables
+
+	for psu_file in psu_files:
+		if(os.path.exists(folder+country+psu_file)):
+			psu_df=pd.read_csv(folder+country+psu_file, index_col=0)
+			psu_df['EA_Num']=psu_df['EA_Num'].astype('int64')
+			ea_df=ea_df.join(psu_df.set_index('EA_Num'), how='left')
+
+	ea_df.to_csv(folder+country+'_EA_agg.csv')
+
+	index_df=pd.DataFrame({'Row': resp_df.index.to_numpy()[order], 'EA_Num': ea_nums[codes[order]], 'EA_Code': codes[order]})
+	index_df.to_csv(folder+country+'_EA_index.csv', index=False)
+
+if __name__ == '__main__':
+
+	import cli
+	cli.main(['afrobarometer']+sys.argv[1:])
@@ -0,0 +1,294 @@
+##########################################################################################################
+#
+# python benchmark.py [-s SIZE ...] [-r REPEATS] [-o OUTPUT]   (or python cli.py benchmark ...)
+#
+# This script measures the running time of the pipeline stages on synthetic data, since the real inputs
+# (Afrobarometer respondent data, TAMSAT, ACLED) cannot be committed. For each size, it generates in a
+# temporary directory:
+#
+#	- an Afrobarometer workbook in the Round 8 column layout
+#	- the PSU polygons and their fixed-distance buffers (shapefiles)
+#	- a TAMSAT-shaped NetCDF cube of monthly rainfall
+#	- an ACLED-like event density raster
+#
+# and times the following stages:
+#
+#	afrobarometer_ingest: the processing of the workbook by afrobarometer.py
+#	rainfall_anomaly: the computation of the rainfall anomaly raster in sample_PSU.py
+#	rainfall_zonal: the mean rainfall anomaly within each PSU buffer in sample_PSU.py
+#	acled_zonal: the mean ACLED event density within each PSU buffer in sample_PSU.py
+#	acled_zonal_parallel: the same, with one worker process per CPU (see parallel_zonal.py)
+#
+# The sizes (small, medium, large, by default all of them) scale the number of respondents, the number of
+# PSUs and the raster grids. Each stage is run REPEATS times (default: 3) and the results are saved to the
+# JSON file OUTPUT (default: benchmark_results.json), one record per size and stage.
+#
+##########################################################################################################
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import netCDF4
+import rasterio
+from rasterio.transform import from_origin
+
+import afrobarometer
+import sample_PSU
+import parallel_zonal
+
+country='kenya'
+country_code='KEN'
+bounds=(34.0, -4.5, 42.0, 4.5) # Bounding box of the synthetic data (lon_min, lat_min, lon_max, lat_max)
+
+# Sizes of the synthetic data
+sizes={
+	'small': {'respondents': 1200, 'psus': 150, 'rfe_pixels': 0.0375, 'acled_pixels': 0.02, 'events': 2000},
+	'medium': {'respondents': 2400, 'psus': 600, 'rfe_pixels': 0.0375, 'acled_pixels': 8.98E-3, 'events': 8000},
+	'large': {'respondents': 4800, 'psus': 2400, 'rfe_pixels': 0.01875, 'acled_pixels': 4.49E-3, 'events': 32000}
+	}
+
+benchmark_kms=[1,20] # Fixed-distance buffers sampled in the zonal benchmarks
+
+def synthetic_workbook(path, respondents, psus, rng):
+	'''
+	Writes an Afrobarometer Round 8 workbook with random answers to the questions read by afrobarometer.py.
+	'''
+
+	ea_nums=rng.integers(0, psus, respondents)+100000
+
+	db=pd.DataFrame({
+		'Respondent number': np.arange(respondents),
+		'EA Unique Number': ea_nums,
+		'This interview, gender': rng.integers(1, 3, respondents)
+		})
+
+	for q in afrobarometer.valid_qs:
+
+		if(q=='Q0'):
+			continue
+
+		valid=list(afrobarometer.valid_values.get(q, range(0,10)))
+
+		if(q=='Q81'):
+			valid=list(afrobarometer.epr_dict[country].keys())
+		elif(q in ['Q95c','Q96c']):
+			valid=list(range(0,13))+[97]
+
+		# A share of the answers are invalid codes (e.g. "Don't know")
+		answers=rng.choice(valid, respondents)
+		invalid=rng.random(respondents)<0.05
+		answers[invalid]=9998
+
+		db[q+'. Synthetic question']=answers
+
+	db['within country weighting factor, weights to EA level ("old AB withinwt")']=rng.uniform(0.5, 2, respondents)
+	db['within country weighting factor, weights to HH level ("new AB withinwt")']=rng.uniform(0.5, 2, respondents)
+	db['GPS Latitude in EA']=rng.uniform(bounds[1], bounds[3], respondents)
+	db['GPS Longitude in EA']=rng.uniform(bounds[0], bounds[2], respondents)
+
+	db.to_excel(path, index=False)
+
+def synthetic_psus(folder, psus, rng):
+	'''
+	Writes the PSU polygons and their fixed-distance buffers as shapefiles in EPSG:4326.
+	'''
+
+	x=rng.uniform(bounds[0]+1, bounds[2]-1, psus)
+	y=rng.uniform(bounds[1]+1, bounds[3]-1, psus)
+	radius=rng.lognormal(np.log(0.01), 0.8, psus) # About 1 km
+
+	# Irregular (star-shaped, hence valid) polygons: discs whose vertices are randomly moved along the radius
+	discs=shapely.buffer(shapely.points(x, y), radius, quad_segs=16)
+	coords, index = shapely.get_coordinates(discs, return_index=True)
+	centres=np.column_stack((x, y))[index]
+	coords=centres+(coords-centres)*rng.uniform(0.7, 1.3, (len(coords),1))
+	polys=shapely.polygons(shapely.linearrings(coords, indices=index))
+
+	ea_nums=np.arange(psus)+100000
+
+	gpd.GeoDataFrame({'EA_Num': ea_nums}, geometry=polys, crs='EPSG:4326').to_file(folder+country_code+'_R8_PSU_polys.shp')
+
+	for km in benchmark_kms:
+		buffers=shapely.buffer(polys, km/111.32)
+		gpd.GeoDataFrame({'EA_Num': ea_nums}, geometry=buffers, crs='EPSG:4326').to_file(folder+country_code+'_R8_PSU_'+str(km)+'km_buffers.shp')
+
+def synthetic_rainfall(path, pixel_size, rng):
+	'''
+	Writes a TAMSAT-shaped NetCDF file with monthly rainfall from the start of the long-term average to the
+	end of the Afrobarometer period.
+	'''
+
+	lon=np.arange(bounds[0], bounds[2], pixel_size)+pixel_size/2
+	lat=np.arange(bounds[3], bounds[1], -pixel_size)-pixel_size/2
+
+	last_year=sample_PSU.country_years[country]+1
+	months=[datetime(year, month, 15, tzinfo=timezone.utc) for year in range(sample_PSU.lta_start, last_year+1) for month in range(1,13)]
+
+	nc=netCDF4.Dataset(path, 'w')
+	nc.createDimension('time', len(months))
+	nc.createDimension('lat', len(lat))
+	nc.createDimension('lon', len(lon))
+
+	nc.createVariable('time', 'f8', ('time',))[:]=[month.timestamp() for month in months]
+	nc.createVariable('lat', 'f4', ('lat',))[:]=lat
+	nc.createVariable('lon', 'f4', ('lon',))[:]=lon
+
+	rfe=nc.createVariable('rfe', 'f4', ('time','lat','lon'), zlib=True)
+	for i in range(0, len(months)):
+		rfe[i,:,:]=rng.gamma(2, 40, (len(lat), len(lon)))
+
+	nc.close()
+
+def synthetic_acled(raster_path, events, pixel_size, rng):
+	'''
+	Writes an ACLED-like raster of the event density, computed as a 2D histogram of synthetic events.
+	'''
+
+	# Events are clustered around a few hotspots
+	hotspots=rng.uniform(bounds[:2], bounds[2:], (20,2))
+	event_hotspots=rng.integers(0, len(hotspots), events)
+	lonlat=hotspots[event_hotspots]+rng.normal(0, 0.3, (events,2))
+	lonlat=np.clip(lonlat, bounds[:2], np.array(bounds[2:])-1e-9)
+
+	x_edges=np.arange(bounds[0], bounds[2]+pixel_size, pixel_size)
+	y_edges=np.arange(bounds[1], bounds[3]+pixel_size, pixel_size)
+	density, _, _ = np.histogram2d(lonlat[:,1], lonlat[:,0], bins=(y_edges, x_edges))
+	density=np.flip(density, axis=0).astype(np.float32)/events
+
+	with rasterio.open(
+		raster_path,
+		'w',
+		driver='GTiff',
+		width=density.shape[1],
+		height=density.shape[0],
+		count=1,
+		dtype=np.float32,
+		crs='EPSG:4326',
+		transform=from_origin(bounds[0], y_edges[-1], pixel_size, pixel_size)
+	) as dst:
+		dst.write(density, 1)
+
+def time_stage(function, repeats):
+	'''
+	Runs the function the given number of times and returns the list of wall times, in seconds.
+	'''
+
+	times=[]
+	for i in range(0, repeats):
+		start=time.perf_counter()
+		function()
+		times.append(time.perf_counter()-start)
+
+	return times
+
+def run_size(size, repeats, rng):
+	'''
+	Generates the synthetic data of the given size in the current directory and times the stages.
+	'''
+
+	params=sizes[size]
+
+	for folder in ['Afrobarometer/'+country_code, 'GIS/'+country_code, 'TAMSAT', 'ACLED']:
+		os.makedirs(folder, exist_ok=True)
+
+	synthetic_workbook('Afrobarometer/'+country_code+'/'+afrobarometer.afrob_files[country], params['respondents'], params['psus'], rng)
+	synthetic_psus('GIS/'+country_code+'/', params['psus'], rng)
+	synthetic_rainfall('TAMSAT/'+country+'_rainfall.nc', params['rfe_pixels'], rng)
+	synthetic_acled('ACLED/'+country+'_ACLED.tif', params['events'], params['acled_pixels'], rng)
+
+	country_month=sample_PSU.country_months[country]
+	month_start=(country_month % 12) + 1
+	year_start=sample_PSU.country_years[country] - (country_month!=12) - (sample_PSU.win_len-1)
+
+	anom_raster, rfe_transform = sample_PSU.rainfall_anomaly('TAMSAT/'+country+'_rainfall.nc', year_start, month_start)
+
+	with rasterio.open('ACLED/'+country+'_ACLED.tif') as src:
+		acled_transform=src.transform
+		acled_array=src.read(1)
+
+	stages={
+		'afrobarometer_ingest': {
+			'function': lambda: afrobarometer.process_country(country),
+			'counts': {'respondents': params['respondents']}
+			},
+		'rainfall_anomaly': {
+			'function': lambda: sample_PSU.rainfall_anomaly('TAMSAT/'+country+'_rainfall.nc', year_start, month_start),
+			'counts': {'pixels': int(anom_raster.size)}
+			}
+		}
+
+	for km in benchmark_kms:
+
+		buffers=gpd.read_file('GIS/'+country_code+'/'+country_code+'_R8_PSU_'+str(km)+'km_buffers.shp')
+		polygons=buffers['geometry'].values
+
+		stages['rainfall_zonal_'+str(km)+'km']={
+			'function': lambda polygons=polygons: sample_PSU.zonal_means(polygons, anom_raster, rfe_transform),
+			'counts': {'polygons': len(polygons), 'pixels': int(anom_raster.size)}
+			}
+		stages['acled_zonal_'+str(km)+'km']={
+			'function': lambda polygons=polygons: sample_PSU.zonal_means(polygons, acled_array, acled_transform),
+			'counts': {'polygons': len(polygons), 'pixels': int(acled_array.size)}
+			}
+		stages['acled_zonal_parallel_'+str(km)+'km']={
+			'function': lambda polygons=polygons: parallel_zonal.parallel_zonal_means(polygons, acled_array, acled_transform),
+			'counts': {'polygons': len(polygons), 'pixels': int(acled_array.size), 'workers': os.cpu_count()}
+			}
+
+	records=[]
+
+	for stage, stage_info in stages.items():
+
+		times=time_stage(stage_info['function'], repeats)
+
+		record={'size': size, 'stage': stage, 'repeats': repeats, 'min_s': min(times), 'median_s': float(np.median(times)), 'times_s': times}
+		record.update(stage_info['counts'])
+		records.append(record)
+
+		print(size, stage, '%.4f s' % min(times))
+
+	return records
+
+def run(selected_sizes, repeats, output):
+	'''
+	Runs the benchmarks of the given sizes, each in its own temporary directory, and saves the results.
+	'''
+
+	output=os.path.abspath(output)
+	rng=np.random.default_rng(0)
+	records=[]
+
+	for size in selected_sizes:
+
+		cwd=os.getcwd()
+
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			os.chdir(tmp_dir)
+			try:
+				records+=run_size(size, repeats, rng)
+			finally:
+				os.chdir(cwd)
+
+	results={
+		'created': datetime.now(timezone.utc).isoformat(),
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'results': records
+		}
+
+	with open(output, 'w') as f:
+		json.dump(results, f, indent=1)
+
+if __name__ == '__main__':
+
+	import cli
+	cli.main(['benchmark']+sys.argv[1:])
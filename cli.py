@@ -0,0 +1,217 @@
+##########################################################################################################
+#
+# python cli.py COMMAND [ARGUMENTS]
+#
+# This script is the single command line interface to the Python stages of the pipeline. Each script can
+# still be run on its own (e.g. "python sample_PSU.py --country kenya" is the same as
+# "python cli.py sample --country kenya"), with the same arguments. The commands are:
+#
+#	afrobarometer: pre-processes the Afrobarometer respondent data (afrobarometer.py)
+#	buffers: creates the PSU buffers (PSU_buffers.py)
+#	aez: assigns the PSUs to the ecological zones (aez_PSU.py)
+#	urban_rural: classifies the PSUs as urban or rural (urban_rural.py)
+#	store: builds the GeoParquet store of the PSU shapefiles (psu_store.py)
+#	simplify: simplifies the PSU polygons and buffers for the rasterization (simplify_PSU.py)
+#	sample: samples the PSU level variables (sample_PSU.py)
+#	exports: exports the Earth Engine rasters of the maps (ee_exports.py)
+#	stats: computes the weighted prevalence of the outcomes with bootstrap intervals (survey_stats.py)
+#	features: imports the sampled CSV files into the PSU feature store (feature_store.py)
+#	cog: converts the map rasters to cloud-optimized GeoTIFFs (cog.py)
+#	run: runs the out of date stages of the whole pipeline (pipeline.py)
+#	benchmark: times the pipeline stages on synthetic data (benchmark.py)
+#
+# Use "python cli.py COMMAND -h" to list the arguments of a command. Only the modules (and thus the
+# backends) needed by the command are imported.
+#
+##########################################################################################################
+
+import sys
+import argparse
+
+countries=['nigeria', 'ethiopia', 'southafrica', 'kenya']
+variables=['nighttime', 'LST_anoms', 'NDVI_anoms', 'rfe_anoms', 'Events']
+
+def add_country_argument(parser):
+
+	parser.add_argument('--country', nargs='+', choices=countries, default=countries, metavar='COUNTRY_STRING',
+		help='countries to process (default: all): '+', '.join(countries))
+
+def build_parser():
+
+	parser=argparse.ArgumentParser(prog='cli.py', description='Pipeline of the Afrobarometer fear and experience of violence study.')
+	subparsers=parser.add_subparsers(dest='command', required=True)
+
+	afrob_parser=subparsers.add_parser('afrobarometer', help='pre-process the Afrobarometer respondent data')
+	add_country_argument(afrob_parser)
+	afrob_parser.add_argument('--ea-table', action='store_true', help='build the PSU aggregates from the respondent CSV files')
+
+	buffers_parser=subparsers.add_parser('buffers', help='create the PSU buffers')
+	add_country_argument(buffers_parser)
+	buffers_parser.add_argument('--buffers', nargs='+', choices=['km','percent'], default=['km','percent'],
+		help='buffer types to create (default: both)')
+
+	aez_parser=subparsers.add_parser('aez', help='assign the PSUs to the ecological zones')
+	add_country_argument(aez_parser)
+	aez_parser.add_argument('--centroids', action='store_true', help='join the PSU centroids instead of the polygons')
+
+	urb_parser=subparsers.add_parser('urban_rural', help='classify the PSUs as urban or rural')
+	add_country_argument(urb_parser)
+	urb_parser.add_argument('--threshold', type=float, default=None,
+		help='built area percentage above which a PSU is urban (see urb_rur.xlsx)')
+
+	store_parser=subparsers.add_parser('store', help='build the GeoParquet store of the PSU shapefiles')
+	add_country_argument(store_parser)
+	store_parser.add_argument('--buffers', nargs='+', default=['poly','km','percent'], metavar='BUFFER',
+		help='spatial units, as in the sample command (default: poly km percent)')
+
+	simplify_parser=subparsers.add_parser('simplify', help='simplify the PSU polygons and buffers for the rasterization')
+	add_country_argument(simplify_parser)
+	simplify_parser.add_argument('--buffers', nargs='+', default=['poly','km','percent'], metavar='BUFFER',
+		help='spatial units, as in the sample command (default: poly km percent)')
+	simplify_parser.add_argument('--coverage-tolerance', type=float, default=0,
+		help='fraction of the pixels of a geometry that the simplification may change (default: 0)')
+
+	sample_parser=subparsers.add_parser('sample', help='sample the PSU level variables')
+	add_country_argument(sample_parser)
+	sample_parser.add_argument('--buffers', nargs='+', default=['poly'], metavar='BUFFER',
+		help='spatial units: poly (default), km, percent or single buffers (e.g. 5km, 200)')
+	sample_parser.add_argument('--variables', nargs='+', choices=variables, default=variables, metavar='VARIABLE',
+		help='variables to sample (default: all): '+', '.join(variables))
+	sample_parser.add_argument('--workers', type=int, default=1,
+		help='processes computing the zonal means of the rainfall and ACLED variables (default: 1)')
+	sample_parser.add_argument('--profile', action='store_true', help='save a profile of the run to Profiles/')
+	sample_parser.add_argument('--tracemalloc', action='store_true', help='also trace the memory allocated by Python')
+	sample_parser.add_argument('--cprofile', action='store_true', help='also save the cProfile statistics of the run')
+
+	exports_parser=subparsers.add_parser('exports', help='export the Earth Engine rasters of the maps')
+	add_country_argument(exports_parser)
+	exports_parser.add_argument('--variables', nargs='+', choices=['LST_anoms','NDVI_anoms'], default=['LST_anoms','NDVI_anoms'],
+		metavar='VARIABLE', help='variables to export (default: LST_anoms NDVI_anoms)')
+	exports_parser.add_argument('--max-in-flight', type=int, default=3, help='tasks running at the same time (default: 3)')
+	exports_parser.add_argument('--poll-interval', type=float, default=10, help='initial interval between two polls of a task, in seconds (default: 10)')
+	exports_parser.add_argument('--drive-folder', default=None, help='local folder synchronized with the Google Drive exports')
+	exports_parser.add_argument('--fake', action='store_true', help='use a local fake task service instead of Earth Engine')
+
+	stats_parser=subparsers.add_parser('stats', help='compute the weighted prevalence of the outcomes with bootstrap intervals')
+	add_country_argument(stats_parser)
+	stats_parser.add_argument('--by', nargs='*', choices=['Urb_Rur','AEZ_Num'], default=[], metavar='GROUP',
+		help='PSU level variables to group the respondents by, besides the country: Urb_Rur, AEZ_Num')
+	stats_parser.add_argument('--weight', choices=['HH_weight','EA_weight'], default='HH_weight', help='respondent weights (default: HH_weight)')
+	stats_parser.add_argument('--replicates', type=int, default=2000, help='bootstrap replicates (default: 2000)')
+	stats_parser.add_argument('--seed', type=int, default=None, help='seed of the bootstrap')
+	stats_parser.add_argument('-o', '--output', default='Results/weighted_prevalence.csv')
+
+	features_parser=subparsers.add_parser('features', help='import the sampled CSV files into the PSU feature store')
+	add_country_argument(features_parser)
+	features_parser.add_argument('--buffers', nargs='+', default=['poly','km','percent'], metavar='BUFFER',
+		help='spatial units, as in the sample command (default: poly km percent)')
+
+	cog_parser=subparsers.add_parser('cog', help='convert the map rasters to cloud-optimized GeoTIFFs')
+	cog_parser.add_argument('files', nargs='*', metavar='FILE', help='GeoTIFFs to convert (default: Maps/*.tif and ACLED/*_ACLED.tif)')
+
+	run_parser=subparsers.add_parser('run', help='run the out of date stages of the pipeline')
+	run_parser.add_argument('stages', nargs='*', metavar='STAGE', help='stages to run, with their dependencies (default: all)')
+	run_parser.add_argument('-n', '--dry-run', action='store_true', help='only print the stages that would be run')
+	run_parser.add_argument('-t', '--touch', action='store_true', help='record the current files as up to date')
+	run_parser.add_argument('-j', '--jobs', type=int, default=None, help='maximum number of stages run at the same time')
+	run_parser.add_argument('--urban-threshold', type=float, default=None,
+		help='urban threshold passed to urban_rural.py (default: the one set in pipeline.py; if unset, the urban_rural stages are skipped)')
+
+	bench_parser=subparsers.add_parser('benchmark', help='time the pipeline stages on synthetic data')
+	bench_parser.add_argument('-s', '--sizes', nargs='+', choices=['small','medium','large'], default=['small','medium','large'])
+	bench_parser.add_argument('-r', '--repeats', type=int, default=3)
+	bench_parser.add_argument('-o', '--output', default='benchmark_results.json')
+
+	return parser
+
+def buffer_choices():
+
+	return ['poly','km','percent']+[str(km)+'km' for km in [1,2,5,10,20,50]]+[str(percent) for percent in [200,300,400,500,750,1000]]
+
+def check_buffers(parser, buffer_args):
+
+	unknown=[buffer_arg for buffer_arg in buffer_args if buffer_arg not in buffer_choices()]
+	if(len(unknown)>0):
+		parser.error('unknown buffers: '+', '.join(unknown)+' (choose from '+', '.join(buffer_choices())+')')
+
+def main(argv=None):
+
+	parser=build_parser()
+	args=parser.parse_args(argv)
+
+	if(args.command=='afrobarometer'):
+		import afrobarometer
+		for country in args.country:
+			if(args.ea_table):
+				afrobarometer.ea_table(country)
+			else:
+				afrobarometer.process_country(country)
+
+	elif(args.command=='buffers'):
+		import PSU_buffers
+		for country in args.country:
+			PSU_buffers.country_buffers(country, km_buffer=('km' in args.buffers), percent_buffer=('percent' in args.buffers))
+
+	elif(args.command=='aez'):
+		import aez_PSU
+		aez_PSU.run(args.country, centroids=args.centroids)
+
+	elif(args.command=='urban_rural'):
+		import urban_rural
+		urban_rural.run(args.country, threshold=args.threshold)
+
+	elif(args.command=='store'):
+		check_buffers(parser, args.buffers)
+
+		import sample_PSU
+		import psu_store
+		psu_store.run(args.country, sample_PSU.buffer_strings(args.buffers))
+
+	elif(args.command=='simplify'):
+		check_buffers(parser, args.buffers)
+
+		import sample_PSU
+		import simplify_PSU
+		simplify_PSU.run(args.country, sample_PSU.buffer_strings(args.buffers), coverage_tolerance=args.coverage_tolerance)
+
+	elif(args.command=='sample'):
+		check_buffers(parser, args.buffers)
+
+		import sample_PSU
+		sample_PSU.run(args.country, sample_PSU.buffer_strings(args.buffers), args.variables, workers=args.workers,
+			profile=args.profile, trace_memory=args.tracemalloc, cprofile=args.cprofile)
+
+	elif(args.command=='exports'):
+		import ee_exports
+		failed=ee_exports.run(args.country, args.variables, max_in_flight=args.max_in_flight, poll_interval=args.poll_interval,
+			drive_folder=args.drive_folder, fake=args.fake)
+		if(len(failed)>0):
+			sys.exit('Failed exports: '+', '.join(failed))
+
+	elif(args.command=='stats'):
+		import survey_stats
+		survey_stats.run(args.country, args.by, weight=args.weight, replicate_num=args.replicates, seed=args.seed, output=args.output)
+
+	elif(args.command=='features'):
+		check_buffers(parser, args.buffers)
+
+		import sample_PSU
+		import feature_store
+		feature_store.run(args.country, sample_PSU.buffer_strings(args.buffers))
+
+	elif(args.command=='cog'):
+		import cog
+		cog.run(args.files)
+
+	elif(args.command=='run'):
+		import pipeline
+		failed=pipeline.run(args.stages, jobs=args.jobs, dry_run=args.dry_run, touch=args.touch, threshold=args.urban_threshold)
+		if(len(failed)>0):
+			sys.exit('Failed stages: '+', '.join(failed))
+
+	elif(args.command=='benchmark'):
+		import benchmark
+		benchmark.run(args.sizes, args.repeats, args.output)
+
+if __name__ == '__main__':
+	main()
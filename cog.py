@@ -0,0 +1,107 @@
+##########################################################################################################
+#
+# python cog.py [FILE ...]
+#
+# This module writes the map rasters (Maps/[COUNTRY_STRING]_[VARIABLE].tif and
+# ACLED/[COUNTRY_STRING]_ACLED.tif) as cloud-optimized GeoTIFFs: tiled (blocksize x blocksize pixels),
+# compressed, with internal overviews (each level halving the resolution, down to a single tile; none for
+# rasters smaller than a tile) and the same nodata value (nodata) in every file. Plots can then read a
+# lower overview level, and windowed reads (e.g. rasterio.windows or the zonal sampling of urban_rural.py)
+# only the tiles they need, instead of the whole raster. maps.ipynb reads the coarsest overview that still
+# fills a map panel, and the full resolution for small rasters or rasters without overviews.
+#
+# Running the script (or "python cli.py cog") converts existing GeoTIFFs in place (by default, all the
+# rasters of the Maps/ and ACLED/ folders). Pixels equal to the previous nodata value of a file, or not
+# finite, are set to the new nodata value.
+#
+##########################################################################################################
+
+import os
+import sys
+import glob
+import numpy as np
+
+nodata=-9999.0
+blocksize=512
+compress='DEFLATE'
+overview_resampling='average'
+
+def default_files():
+
+	return sorted(glob.glob('Maps/*.tif')+glob.glob('ACLED/*_ACLED.tif'))
+
+def overview_factors(height, width):
+	'''
+	Returns the overview decimation factors (2, 4, 8...) until the raster fits in a single tile (none for
+	rasters smaller than a tile).
+	'''
+
+	factors=[]
+	factor=2
+
+	while(max(height, width)>blocksize*factor/2):
+		factors.append(factor)
+		factor*=2
+
+	return factors
+
+def write_cog(path, array, transform, crs='EPSG:4326'):
+	'''
+	Writes a single-band array (a masked array, or an array with NaN for the missing pixels) to a
+	cloud-optimized GeoTIFF.
+	'''
+
+	from rasterio.enums import Resampling
+	from rasterio.io import MemoryFile
+	from rasterio.shutil import copy
+
+	data=np.ma.masked_invalid(np.ma.asarray(array, dtype=np.float32))
+	data=data.filled(nodata).astype(np.float32)
+
+	profile={
+		'driver': 'GTiff',
+		'width': data.shape[1],
+		'height': data.shape[0],
+		'count': 1,
+		'dtype': 'float32',
+		'crs': crs,
+		'transform': transform,
+		'nodata': nodata
+		}
+
+	# The overviews are built in memory and copied after the full-resolution tiles, as the COG layout requires
+	with MemoryFile() as memfile:
+		with memfile.open(**profile) as mem:
+			mem.write(data, 1)
+			mem.build_overviews(overview_factors(*data.shape), getattr(Resampling, overview_resampling))
+
+			folder=os.path.dirname(path)
+			if(folder!=''):
+				os.makedirs(folder, exist_ok=True)
+
+			copy(mem, path, driver='GTiff', tiled=True, blockxsize=blocksize, blockysize=blocksize,
+				compress=compress, predictor=3, copy_src_overviews=True)
+
+def convert_to_cog(path):
+	'''
+	Rewrites an existing single-band GeoTIFF as a cloud-optimized GeoTIFF.
+	'''
+
+	import rasterio
+
+	with rasterio.open(path) as src:
+		array=src.read(1, masked=True).astype(np.float32)
+		transform=src.transform
+		crs=src.crs
+
+	write_cog(path, array, transform, crs)
+
+def run(files=None):
+
+	for path in files or default_files():
+		convert_to_cog(path)
+		print(path)
+
+if __name__ == '__main__':
+	import cli
+	cli.main(['cog']+sys.argv[1:])
@@ -0,0 +1,314 @@
+##########################################################################################################
+#
+# python ee_exports.py [--country COUNTRY_STRING ...] [--variables VARIABLE ...] [--max-in-flight N]
+#                      [--poll-interval SECONDS] [--drive-folder FOLDER] [--fake]
+#
+# This script exports the standardized anomaly rasters of the Google Earth Engine variables (LST_anoms and
+# NDVI_anoms, see sample_PSU.py) of all the selected countries for the maps of maps.ipynb. It is equivalent
+# to "python cli.py exports" and replaces the export cells of environmentals.ipynb.
+#
+# All the (country, variable) exports are submitted as Earth Engine batch tasks, at most --max-in-flight
+# (default: 3) at the same time. The running tasks are polled concurrently; the interval between two polls
+# of a task starts at --poll-interval seconds and doubles each time the task is found unchanged, up to
+# max_poll_interval. A failed task is submitted again up to max_retries times.
+#
+# Earth Engine saves the rasters to your Google Drive. If the Drive is synchronized to a local folder, pass
+# it with --drive-folder and the finished rasters are moved to Maps/[COUNTRY_STRING]_[VARIABLE].tif and
+# converted to cloud-optimized GeoTIFFs (see cog.py); otherwise they are only registered. Either way, the
+# final state, Drive URIs and local file of each export are recorded in Maps/exports.json.
+#
+# The --fake flag runs the same exports against a local fake task service (see FakeTaskService), which
+# simulates the task states, delays and failures without an Earth Engine account. The placeholder rasters
+# and the registry are then written to a temporary folder, leaving the Maps/ folder untouched.
+#
+##########################################################################################################
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+max_in_flight=3 # Tasks running on Earth Engine at the same time
+poll_interval=10 # Initial interval between two polls of a task (s)
+max_poll_interval=300 # Maximum interval between two polls of a task (s)
+max_retries=2 # Submissions of a failed task after the first one
+poll_workers=8 # Threads polling the tasks
+
+maps_folder='Maps/'
+registry_file='Maps/exports.json'
+
+export_variables=['LST_anoms', 'NDVI_anoms']
+
+# Years averaged in the anomaly images of the maps, as in the export cells of environmentals.ipynb (the
+# sampled NDVI_anoms variable averages win_len=2 years instead)
+map_windows={'LST_anoms': 2, 'NDVI_anoms': 1}
+
+# FIPS codes of the countries in the USDOS/LSIB_SIMPLE/2017 boundaries
+country_fips={'kenya': 'KE', 'nigeria': 'NI', 'ethiopia': 'ET', 'southafrica': 'SF'}
+
+# Earth Engine task states
+running_states=['UNSUBMITTED', 'READY', 'RUNNING', 'CANCEL_REQUESTED']
+failed_states=['FAILED', 'CANCELLED']
+
+class EarthEngineTaskService:
+	'''
+	Submits the exports as Earth Engine batch tasks saving the rasters to Google Drive.
+	'''
+
+	def __init__(self, drive_folder=None):
+
+		self.drive_folder=drive_folder
+
+	def submit(self, job):
+
+		import sample_PSU
+
+		ee=sample_PSU.init_ee()
+
+		country=job['country']
+		country_month=sample_PSU.country_months[country]
+		month_start = (country_month % 12) + 1
+		year_start = sample_PSU.country_years[country] - (country_month!=12) - (sample_PSU.win_len-1)
+
+		country_ee = ee.FeatureCollection('USDOS/LSIB_SIMPLE/2017').filter(ee.Filter.eq('country_co',country_fips[country])).first()
+
+		anomImg, crs = sample_PSU.modis_anomaly_image(job['variable'], year_start, month_start, window=map_windows[job['variable']])
+
+		task_config = {
+			'scale': crs.nominalScale().getInfo(),
+			'region': country_ee.geometry(),
+			'maxPixels': 200000000
+			}
+
+		task=ee.batch.Export.image(anomImg.clip(country_ee), job['name'], task_config)
+		task.start()
+
+		return task
+
+	def status(self, task):
+
+		return task.status()
+
+	def fetch(self, job, status):
+		'''
+		Moves the finished raster from the synchronized Drive folder to the Maps/ folder. Returns the local
+		file, or None if the raster is only registered.
+		'''
+
+		if(self.drive_folder is None):
+			return None
+
+		drive_file=os.path.join(self.drive_folder, job['name']+'.tif')
+		if(not os.path.exists(drive_file)):
+			print('Not yet synchronized:', drive_file)
+			return None
+
+		shutil.move(drive_file, job['file'])
+
+		from cog import convert_to_cog
+		convert_to_cog(job['file'])
+
+		return job['file']
+
+class FakeTaskService:
+	'''
+	Local stand-in for Earth Engine: each task goes through READY and RUNNING and completes after a random
+	number of polls; some tasks fail and some polls raise an error, as a busy service would. The finished
+	rasters are written as small placeholder files.
+	'''
+
+	def __init__(self, fail_rate=0.2, error_rate=0.1, polls=(1,5), seed=None):
+
+		self.fail_rate=fail_rate
+		self.error_rate=error_rate
+		self.polls=polls
+		self.random=random.Random(seed)
+		self.submitted=0
+
+	def submit(self, job):
+
+		self.submitted+=1
+
+		return {
+			'id': 'FAKE'+str(self.submitted),
+			'description': job['name'],
+			'polls_left': self.random.randint(*self.polls),
+			'fails': self.random.random()<self.fail_rate,
+			'state': 'READY'
+			}
+
+	def status(self, task):
+
+		if(self.random.random()<self.error_rate):
+			raise ConnectionError('fake transient error')
+
+		if(task['state'] in ['READY', 'RUNNING']):
+			task['polls_left']-=1
+			if(task['polls_left']<=0):
+				task['state']='FAILED' if task['fails'] else 'COMPLETED'
+			else:
+				task['state']='RUNNING'
+
+		status={'id': task['id'], 'description': task['description'], 'state': task['state']}
+		if(task['state']=='FAILED'):
+			status['error_message']='fake failure'
+		elif(task['state']=='COMPLETED'):
+			status['destination_uris']=['fake://'+task['description']+'.tif']
+
+		return status
+
+	def fetch(self, job, status):
+
+		with open(job['file'], 'w') as f:
+			f.write(status['id']+'\n')
+
+		return job['file']
+
+def export_jobs(countries, variables, folder=maps_folder):
+	'''
+	Returns one export for each (country, variable) pair.
+	'''
+
+	return [{
+		'name': country+'_'+variable,
+		'country': country,
+		'variable': variable,
+		'file': os.path.join(folder, country+'_'+variable+'.tif')
+		} for country in countries for variable in variables]
+
+def run_exports(jobs, service, max_in_flight=max_in_flight, poll_interval=poll_interval):
+	'''
+	Submits the exports to the task service, keeping at most max_in_flight tasks running, and polls the
+	running tasks concurrently with exponential backoff until all are finished. The finished rasters are
+	fetched by the service. Returns the final record of each export.
+	'''
+
+	pending=list(jobs)
+	in_flight={} # Name: {'job', 'task', 'state', 'next_poll', 'interval'}
+	records={}
+	attempts={job['name']: 0 for job in jobs}
+
+	with ThreadPoolExecutor(max_workers=poll_workers) as executor:
+
+		while(len(pending)>0 or len(in_flight)>0):
+
+			while(len(pending)>0 and len(in_flight)<max_in_flight):
+				job=pending.pop(0)
+				attempts[job['name']]+=1
+				print('Submitting', job['name'], '(attempt '+str(attempts[job['name']])+')')
+				try:
+					task=service.submit(job)
+				except Exception as error:
+					print('Submission failed:', job['name'], error)
+					records[job['name']]={'state': 'FAILED', 'error': str(error)}
+					continue
+				in_flight[job['name']]={'job': job, 'task': task, 'state': 'READY', 'next_poll': time.monotonic()+poll_interval, 'interval': poll_interval}
+
+			if(len(in_flight)==0):
+				continue
+
+			# Waiting for the next task to poll
+			next_poll=min(entry['next_poll'] for entry in in_flight.values())
+			time.sleep(max(0, next_poll-time.monotonic()))
+
+			now=time.monotonic()
+			due=[name for name, entry in in_flight.items() if entry['next_poll']<=now]
+			futures={name: executor.submit(service.status, in_flight[name]['task']) for name in due}
+
+			for name, future in futures.items():
+
+				entry=in_flight[name]
+				job=entry['job']
+
+				try:
+					status=future.result()
+				except Exception as error:
+					print('Polling failed:', name, error)
+					status={'state': entry['state']}
+
+				state=status['state']
+
+				if(state in running_states):
+					# Backing off while the task is unchanged
+					if(state==entry['state']):
+						entry['interval']=min(2*entry['interval'], max_poll_interval)
+					entry['state']=state
+					entry['next_poll']=time.monotonic()+entry['interval']
+					continue
+
+				del in_flight[name]
+
+				if(state in failed_states):
+					print('Failed:', name, status.get('error_message', state))
+					if(attempts[name]<=max_retries):
+						pending.append(job)
+						continue
+					records[name]={'state': state, 'error': status.get('error_message', '')}
+					continue
+
+				print('Completed:', name)
+				record={'state': state, 'uris': status.get('destination_uris', []), 'file': None}
+				try:
+					record['file']=service.fetch(job, status)
+				except Exception as error:
+					print('Fetching failed:', name, error)
+					record['error']=str(error)
+				records[name]=record
+
+	for job in jobs:
+		records[job['name']].update({'country': job['country'], 'variable': job['variable'], 'attempts': attempts[job['name']]})
+
+	return records
+
+def save_records(records, path=registry_file):
+	'''
+	Adds the export records to the registry, keeping the records of the other exports.
+	'''
+
+	registry={}
+	if(os.path.exists(path)):
+		with open(path) as f:
+			registry=json.load(f)
+
+	timestamp=datetime.now().isoformat(timespec='seconds')
+	for name, record in records.items():
+		registry[name]=dict(record, updated=timestamp)
+
+	with open(path, 'w') as f:
+		json.dump(registry, f, indent=1)
+
+def run(countries, variables, max_in_flight=max_in_flight, poll_interval=poll_interval, drive_folder=None, fake=False):
+
+	'''
+	Exports the rasters of the selected variables of the selected countries. Returns the exports that did not
+	complete.
+	'''
+
+	folder=maps_folder
+	registry=registry_file
+
+	if(fake):
+		service=FakeTaskService()
+		poll_interval=min(poll_interval, 0.1)
+		folder=tempfile.mkdtemp(prefix='ee_exports_')
+		registry=os.path.join(folder, 'exports.json')
+		print('Fake exports saved to', folder)
+	else:
+		service=EarthEngineTaskService(drive_folder)
+
+	os.makedirs(folder, exist_ok=True)
+
+	records=run_exports(export_jobs(countries, variables, folder), service, max_in_flight=max_in_flight, poll_interval=poll_interval)
+
+	save_records(records, registry)
+
+	return [name for name, record in records.items() if record['state']!='COMPLETED']
+
+if __name__ == '__main__':
+	import cli
+	cli.main(['exports']+sys.argv[1:])
@@ -0,0 +1,120 @@
+##########################################################################################################
+#
+# python feature_store.py [--country COUNTRY_STRING ...] [--buffers BUFFER ...]
+#
+# This module is a long-format store of the PSU level variables sampled by sample_PSU.py, consolidating the
+# [COUNTRY_STRING]_vars_PSU_[BUFFER]_2.csv files of all the countries and spatial units in a single Parquet
+# dataset, partitioned by country, buffer and variable:
+#
+#	Afrobarometer/features/country=[COUNTRY_STRING]/buffer=[BUFFER]/variable=[VARIABLE]/part-0.parquet
+#
+# Each file holds the EA_Num and value columns of one variable. sample_PSU.py replaces the files of the
+# variables it samples, so the store always matches the CSV files. A slice of the store (any combination of
+# countries, buffers and variables) is read at once with read_features(), which only opens the files of
+# the selected partitions, e.g.
+#
+#	ndvi_km = feature_store.read_features(buffers=['km'], variables=['NDVI_anoms'])
+#
+# returns the country, buffer, EA_Num, variable and value columns of all the fixed-distance buffers. The
+# partitions can also be read from R with arrow::open_dataset('Afrobarometer/features').
+#
+# Running the script (or "python cli.py features") imports the existing CSV files of the selected countries
+# and spatial units (same --buffers values as sample_PSU.py, default: poly km percent) into the store.
+#
+##########################################################################################################
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+store_folder='Afrobarometer/features'
+
+country_codes={'kenya': 'KEN', 'nigeria': 'NIG', 'ethiopia': 'ETH', 'southafrica': 'SAF'}
+
+def partition_folder(country, buffer_str, variable):
+
+	return os.path.join(store_folder, 'country='+country, 'buffer='+buffer_str, 'variable='+variable)
+
+def write_features(psu_df, country, buffer_str):
+	'''
+	Writes the variables of the dataframe (one column per variable, plus EA_Num) to the store, replacing
+	the partitions of these variables for the country and buffer.
+	'''
+
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+
+	ea_nums=psu_df['EA_Num'].to_numpy(dtype=np.int64)
+
+	for variable in psu_df.columns:
+
+		if(variable=='EA_Num'):
+			continue
+
+		folder=partition_folder(country, buffer_str, variable)
+		os.makedirs(folder, exist_ok=True)
+
+		table=pa.table({'EA_Num': ea_nums, 'value': psu_df[variable].to_numpy(dtype=np.float64)})
+
+		# Writing to a hidden temporary file first, so that readers never see a partial file
+		pq.write_table(table, os.path.join(folder, '.part-0.parquet.tmp'))
+		os.replace(os.path.join(folder, '.part-0.parquet.tmp'), os.path.join(folder, 'part-0.parquet'))
+
+def read_features(countries=None, buffers=None, variables=None, wide=False):
+	'''
+	Reads a slice of the store. The buffers take the same values as the --buffers argument of sample_PSU.py
+	(e.g. "km" for all the fixed-distance buffers); None selects everything. Returns the long-format
+	dataframe (country, buffer, EA_Num, variable, value) or, if wide is True, one column per variable
+	indexed by (country, buffer, EA_Num).
+	'''
+
+	import pyarrow as pa
+	import pyarrow.dataset as ds
+	from sample_PSU import buffer_strings
+
+	partitioning=ds.partitioning(pa.schema([('country', pa.string()), ('buffer', pa.string()), ('variable', pa.string())]), flavor='hive')
+	dataset=ds.dataset(store_folder, format='parquet', partitioning=partitioning)
+
+	selection=None
+	for field, values in [('country', countries), ('buffer', None if buffers is None else buffer_strings(buffers)), ('variable', variables)]:
+		if(values is not None):
+			condition=ds.field(field).isin(list(values))
+			selection=condition if selection is None else selection & condition
+
+	features=dataset.to_table(columns=['country', 'buffer', 'EA_Num', 'variable', 'value'], filter=selection).to_pandas()
+
+	for column in ['country', 'buffer', 'variable']:
+		features[column]=features[column].astype('category')
+
+	if(wide):
+		features=features.pivot_table(index=['country', 'buffer', 'EA_Num'], columns='variable', values='value', observed=True)
+		features.columns.name=None
+
+	return features
+
+def run(countries, buffer_strs):
+	'''
+	Imports the existing CSV files of the selected countries and spatial units into the store.
+	'''
+
+	for country in countries:
+
+		country_code=country_codes[country]
+
+		for buffer_str in buffer_strs:
+
+			csv_file='Afrobarometer/'+country_code+'/'+country+'_vars_PSU_'+buffer_str+'_2.csv'
+
+			if(not os.path.exists(csv_file)):
+				print(country, buffer_str, 'not found:', csv_file)
+				continue
+
+			psu_df=pd.read_csv(csv_file, index_col=0)
+			write_features(psu_df, country, buffer_str)
+
+			print(country, buffer_str)
+
+if __name__ == '__main__':
+	import cli
+	cli.main(['features']+sys.argv[1:])
@@ -0,0 +1,96 @@
+##########################################################################################################
+#
+# This module computes the zonal means of sample_PSU.py (see zonal_means) with several worker processes.
+#
+# The raster is written once to a memory-mapped .npy file in a temporary directory and the polygons to a
+# file of WKB geometries. Each worker maps the raster (the operating system shares its pages between all
+# the processes, so the memory does not grow with the number of workers) and loads the polygons once,
+# then only receives ranges of polygon indices. The results of the ranges are gathered into the output
+# array in the original polygon order, and the nearest-pixel fallback of the polygons covering no finite
+# pixel is computed once, in the main process.
+#
+##########################################################################################################
+
+import os
+import pickle
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from sample_PSU import zonal_means, nearest_values
+
+chunks_per_worker=4 # Index ranges per worker, to balance polygons of different sizes
+
+# State of each worker process, set by init_worker
+worker_raster=None
+worker_polygons=None
+worker_transform=None
+
+def init_worker(raster_path, polygons_path, transform):
+
+	global worker_raster, worker_polygons, worker_transform
+
+	import shapely
+
+	worker_raster=np.load(raster_path, mmap_mode='r')
+
+	with open(polygons_path, 'rb') as f:
+		worker_polygons=shapely.from_wkb(pickle.load(f))
+
+	worker_transform=transform
+
+def sample_range(index_range):
+	'''
+	Computes the zonal means of the polygons with indices in [start, end).
+	'''
+
+	start, end = index_range
+
+	return start, zonal_means(worker_polygons[start:end], worker_raster, worker_transform, fallback=False)
+
+def index_ranges(feat_num, workers):
+	'''
+	Splits the polygon indices into contiguous ranges.
+	'''
+
+	chunk=max(1, int(np.ceil(feat_num/(workers*chunks_per_worker))))
+
+	return [(start, min(start+chunk, feat_num)) for start in range(0, feat_num, chunk)]
+
+def parallel_zonal_means(polygons, raster, transform, workers=None, nearest_index=None):
+	'''
+	Same as sample_PSU.zonal_means, with the polygons split among the given number of worker processes
+	(by default, the number of CPUs).
+	'''
+
+	import shapely
+
+	workers=workers or os.cpu_count()
+	feat_num=len(polygons)
+	values=np.zeros(feat_num)
+
+	if(feat_num==0):
+		return values
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+
+		raster_path=os.path.join(tmp_dir, 'raster.npy')
+		polygons_path=os.path.join(tmp_dir, 'polygons.pkl')
+
+		shared=np.lib.format.open_memmap(raster_path, mode='w+', dtype=raster.dtype, shape=raster.shape)
+		shared[:]=raster
+		shared.flush()
+		del shared
+
+		with open(polygons_path, 'wb') as f:
+			pickle.dump(list(shapely.to_wkb(np.asarray(polygons))), f)
+
+		with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(raster_path, polygons_path, transform)) as executor:
+
+			for start, range_values in executor.map(sample_range, index_ranges(feat_num, workers)):
+				values[start:start+len(range_values)]=range_values
+
+	# The nearest-pixel fallback is computed once for all the ranges
+	empty=np.flatnonzero(np.isnan(values))
+	values[empty]=nearest_values(np.asarray(polygons)[empty], raster, transform, nearest_index)
+
+	return values
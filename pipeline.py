@@ -0,0 +1,427 @@
+##########################################################################################################
+#
+# python pipeline.py [-n] [-t] [-j JOBS] [--urban-threshold THRESHOLD] [STAGE ...]   (or python cli.py run ...)
+#
+# This script runs the processing stages described in the README (pre-processing of the Afrobarometer data,
+# imputation, PSU buffers, ecological zones, urban-rural variable, sampling of the PSU variables and
+# regressions) in dependency order, running only the stages whose results are out of date.
+#
+# Each stage declares the files it reads and writes (its own script is always one of its inputs). The
+# contents of these files are hashed and, after a stage completes, the hashes are recorded in the
+# .pipeline_state.json file. A stage is run again only if one of its inputs or outputs has changed since then,
+# or if an output is missing. The stages are declared per country wherever the scripts allow it, so that
+# changing one country's data only rebuilds that country's artifacts (and the regressions pooling all
+# countries). Stages that do not depend on each other are run in parallel.
+#
+#	-n: only print the stages that would be run
+#
+#	-t: record the current files as up to date without running anything (e.g. to adopt the results
+#	    included in the repository)
+#
+#	-j JOBS: maximum number of stages run at the same time (default: number of CPUs)
+#
+#	--urban-threshold THRESHOLD: built area percentage above which a PSU is urban, passed to urban_rural.py
+#	    (default: urban_threshold below). If it is not set, the urban_rural stages are left out and the
+#	    _Urb_Rur.csv files included in the repository are used as they are.
+#
+# If stage names are provided, only those stages and the stages they depend on are considered.
+#
+# The stages run without a terminal, so the Google Earth Engine credentials must be stored beforehand
+# (run "earthengine authenticate" once).
+#
+##########################################################################################################
+
+import os
+import sys
+import json
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+state_file='.pipeline_state.json'
+
+urban_threshold=None # Urban threshold of urban_rural.py (see urb_rur.xlsx)
+
+country_codes={'kenya': 'KEN', 'nigeria': 'NIG', 'ethiopia': 'ETH', 'southafrica': 'SAF'}
+
+afrob_files = {
+	'nigeria': 'NIG_R8.Data.wtd.final_1JUN23.xlsx',
+	'ethiopia': 'ETH_R8.Data.wtd.final_31May23.xlsx',
+	'kenya': 'KEN_R8.Data.wtd.final_31May23.xlsx',
+	'southafrica': 'SAF_R8.Data.wtd.final_1JUN23.xlsx'
+	}
+
+# Lists of buffers
+percents=[200,300,400,500,750,1000]
+kms=[1,2,5,10,20,50]
+
+scales=['Resp','EA']
+outcomes=['Q54aF','Q54aE','Q54bF','Q54bE','Q54cF','Q54cE']
+
+shapefile_exts=['.shp','.shx','.dbf','.prj']
+
+def shapefile(path):
+	'''
+	Returns the files making up a shapefile, given its path without extension.
+	'''
+
+	return [path+ext for ext in shapefile_exts]
+
+def country_stages(country, urban_threshold=urban_threshold):
+	'''
+	Returns the stages operating on a single country. The urban_rural stage is only included if the urban
+	threshold is set.
+	'''
+
+	acr=country_codes[country]
+	afrob_folder='Afrobarometer/'+acr+'/'
+	gis_folder='GIS/'+acr+'/'
+
+	polys=shapefile(gis_folder+acr+'_R8_PSU_polys')
+	km_buffers=[file for km in kms for file in shapefile(gis_folder+acr+'_R8_PSU_'+str(km)+'km_buffers')]
+	percent_buffers=[file for percent in percents for file in shapefile(gis_folder+acr+'_R8_PSU_'+str(percent)+'_buffers')]
+	rasters=['TAMSAT/'+country+'_rainfall.nc', 'ACLED/'+country+'_ACLED.tif']
+	sample_inputs=['sample_PSU.py', 'simplify_PSU.py']+rasters
+
+	def simplified(files):
+		return [file[:-4]+'_simplified'+file[-4:] for file in files]+[file[:-4]+'_simplified.json' for file in files if file.endswith('.shp')]
+
+	# The _store.json records are left out: psu_store rewrites them when only the shapefile times change
+	# (e.g. after a fresh checkout), which must not rerun the stages loading the store
+	def stored(files):
+		return [file[:-4]+suffix for file in files if file.endswith('.shp') for suffix in ['_native.parquet', '_4326.parquet']]
+
+	stages=[
+		{
+		'name': 'afrobarometer_'+country,
+		'command': ['python','afrobarometer.py','--country',country],
+		'inputs': ['afrobarometer.py', afrob_folder+afrob_files[country]],
+		'outputs': [afrob_folder+country+'_afrob_vars.csv']
+		},
+		{
+		'name': 'miss_forest_'+country,
+		'command': ['Rscript','miss_forest.R',country],
+		'inputs': ['miss_forest.R', afrob_folder+country+'_afrob_vars.csv'],
+		'outputs': [afrob_folder+country+'_afrob_imp.csv']
+		},
+		{
+		'name': 'buffers_'+country,
+		'command': ['python','PSU_buffers.py','--country',country],
+		'inputs': ['PSU_buffers.py']+polys,
+		'outputs': km_buffers+percent_buffers
+		},
+		{
+		'name': 'store_'+country,
+		'command': ['python','psu_store.py','--country',country],
+		'inputs': ['psu_store.py']+polys+km_buffers+percent_buffers,
+		'outputs': stored(polys+km_buffers+percent_buffers)
+		},
+		{
+		'name': 'simplify_'+country,
+		'command': ['python','simplify_PSU.py','--country',country],
+		'inputs': ['simplify_PSU.py']+rasters+stored(polys+km_buffers+percent_buffers),
+		'outputs': simplified(polys+km_buffers+percent_buffers)
+		},
+		{
+		'name': 'aez_'+country,
+		'command': ['python','aez_PSU.py','--country',country],
+		'inputs': ['aez_PSU.py']+stored(polys)+shapefile('Ecological_areas/'+acr+'/mst_thz_'+country+'_poly'),
+		'outputs': [afrob_folder+country+'_AEZ_PSU.csv']
+		},
+		{
+		'name': 'urban_rural_'+country,
+		'command': ['python','urban_rural.py','--threshold',str(urban_threshold),'--country',country],
+		'inputs': ['urban_rural.py', 'Built/'+country+'_built.tif']+stored(polys),
+		'outputs': [afrob_folder+country+'_Urb_Rur.csv']
+		},
+		{
+		'name': 'sample_poly_'+country,
+		'command': ['python','sample_PSU.py','--country',country],
+		'inputs': sample_inputs+stored(polys)+simplified(polys),
+		'outputs': [afrob_folder+country+'_vars_PSU_poly_2.csv']
+		},
+		{
+		'name': 'sample_km_'+country,
+		'command': ['python','sample_PSU.py','--buffers','km','--country',country],
+		'inputs': sample_inputs+stored(km_buffers)+simplified(km_buffers),
+		'outputs': [afrob_folder+country+'_vars_PSU_'+str(km)+'km_2.csv' for km in kms]
+		},
+		{
+		'name': 'sample_percent_'+country,
+		'command': ['python','sample_PSU.py','--buffers','percent','--country',country],
+		'inputs': sample_inputs+stored(percent_buffers)+simplified(percent_buffers),
+		'outputs': [afrob_folder+country+'_vars_PSU_'+str(percent)+'_2.csv' for percent in percents]
+		},
+		{
+		'name': 'ea_table_'+country,
+		'command': ['python','afrobarometer.py','--ea-table','--country',country],
+		'inputs': ['afrobarometer.py', afrob_folder+country+'_afrob_vars.csv']+[afrob_folder+country+suffix for suffix in ['_vars_PSU_poly_2.csv', '_Urb_Rur.csv', '_AEZ_PSU.csv']],
+		'outputs': [afrob_folder+country+'_EA_agg.csv', afrob_folder+country+'_EA_index.csv']
+		}
+		]
+
+	if(urban_threshold is None):
+		stages=[stage for stage in stages if stage['name']!='urban_rural_'+country]
+
+	return stages
+
+def regression_stages():
+	'''
+	Returns the regression stages, which pool the data of all the countries.
+	'''
+
+	def country_files(buffer_str):
+		files=[]
+		for country, acr in country_codes.items():
+			afrob_folder='Afrobarometer/'+acr+'/'
+			files+=[afrob_folder+country+suffix for suffix in ['_afrob_imp.csv', '_Urb_Rur.csv', '_AEZ_PSU.csv', '_vars_PSU_'+buffer_str+'_2.csv']]
+		return files
+
+	def result_files(suffix):
+		files=[]
+		for scale in scales:
+			files+=['Results/'+result+'_'+scale+'_bj'+suffix+'.Rda' for result in ['coefs','stderrs','pvalues']]
+		return files+['Results/ranvar_bj'+suffix+'.Rda', 'Results/auc_bj'+suffix+'.Rda']
+
+	stages=[
+		{
+		'name': 'multi_scale',
+		'command': ['Rscript','multi_scale_bj.R'],
+		'inputs': ['multi_scale_bj.R', 'belljones.R']+country_files('poly'),
+		'outputs': result_files('')+['Results/ranef/ranef_'+acr+'_'+outcome+'.Rda' for acr in country_codes.values() for outcome in outcomes]
+		},
+		{
+		'name': 'all_countries',
+		'command': ['Rscript','all_countries_bj.R'],
+		'inputs': ['all_countries_bj.R', 'belljones.R']+country_files('poly'),
+		'outputs': result_files('_allcountries')+['Results/ranef/ranef_allcountries_'+outcome+'.Rda' for outcome in outcomes]
+		},
+		{
+		'name': 'all_countries_km',
+		'command': ['Rscript','all_countries_bj.R','-k'],
+		'inputs': ['all_countries_bj.R', 'belljones.R']+[file for km in kms for file in country_files(str(km)+'km')],
+		'outputs': ['Results/auc_bj_allcountries_kms.Rda']
+		},
+		{
+		'name': 'all_countries_percent',
+		'command': ['Rscript','all_countries_bj.R','-p'],
+		'inputs': ['all_countries_bj.R', 'belljones.R']+[file for percent in percents for file in country_files(str(percent))],
+		'outputs': ['Results/auc_bj_allcountries_percents.Rda']
+		}
+		]
+
+	return stages
+
+def all_stages(urban_threshold=urban_threshold):
+	'''
+	Returns the list of all the stages of the pipeline.
+	'''
+
+	stages=[]
+	for country in country_codes.keys():
+		stages+=country_stages(country, urban_threshold)
+
+	return stages+regression_stages()
+
+def dependencies(stages):
+	'''
+	Returns, for each stage name, the set of names of the stages producing one of its inputs.
+	'''
+
+	producers=dict()
+	for stage in stages:
+		for output in stage['outputs']:
+			producers[output]=stage['name']
+
+	deps=dict()
+	for stage in stages:
+		deps[stage['name']]={producers[file] for file in stage['inputs'] if file in producers}
+
+	return deps
+
+def file_hash(path, file_cache):
+	'''
+	Returns the SHA-256 hash of a file's contents, or None if the file does not exist.
+	The hash is only recomputed if the file's size or modification time has changed.
+	'''
+
+	try:
+		stat=os.stat(path)
+	except FileNotFoundError:
+		return None
+
+	cached=file_cache.get(path)
+	if(cached is not None and cached[0]==stat.st_size and cached[1]==stat.st_mtime_ns):
+		return cached[2]
+
+	sha=hashlib.sha256()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1<<20), b''):
+			sha.update(block)
+
+	file_cache[path]=[stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+
+	return file_cache[path][2]
+
+def stage_record(stage, file_cache):
+	'''
+	Returns the command and the current hashes of the inputs and outputs of a stage.
+	'''
+
+	return {
+		'command': stage['command'],
+		'inputs': {file: file_hash(file, file_cache) for file in stage['inputs']},
+		'outputs': {file: file_hash(file, file_cache) for file in stage['outputs']}
+		}
+
+def is_stale(stage, state):
+	'''
+	A stage is stale if it never completed, if its command, inputs or outputs have changed since then, or if
+	one of its outputs is missing.
+	'''
+
+	record=stage_record(stage, state['files'])
+
+	if(None in record['outputs'].values()):
+		return True
+
+	return state['stages'].get(stage['name'])!=record
+
+def save_state(state):
+
+	with open(state_file+'.tmp', 'w') as f:
+		json.dump(state, f, indent=1, sort_keys=True)
+
+	os.replace(state_file+'.tmp', state_file)
+
+def load_state():
+
+	if(os.path.exists(state_file)):
+		with open(state_file) as f:
+			return json.load(f)
+
+	return {'files': dict(), 'stages': dict()}
+
+def run_stage(stage):
+
+	# Without a terminal, so that the stages run in parallel never start an interactive prompt
+	# (e.g. the Google Earth Engine authentication, see sample_PSU.init_ee)
+	return subprocess.run(stage['command'], stdin=subprocess.DEVNULL).returncode
+
+def run_pipeline(stages, jobs=None, dry_run=False, touch=False):
+	'''
+	Runs the stale stages, each as soon as all the stages it depends on have completed.
+	Returns the names of the stages that failed or could not be run because a dependency failed.
+	'''
+
+	state=load_state()
+	deps=dependencies(stages)
+	stage_dict={stage['name']: stage for stage in stages}
+
+	pending=[stage['name'] for stage in stages]
+	finished=set()
+	would_run=set()
+	failed=[]
+	running=dict()
+
+	with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+
+		while(len(pending)>0 or len(running)>0):
+
+			# Submitting the stages whose dependencies have all completed
+			for name in list(pending):
+
+				if(deps[name] & set(failed)):
+					pending.remove(name)
+					failed.append(name)
+					print('skipped', name)
+
+				elif(deps[name] <= finished):
+					pending.remove(name)
+					stage=stage_dict[name]
+
+					# Upstream stages that were only listed (dry run) are assumed to change their outputs
+					upstream_run=len(deps[name] & would_run)>0
+
+					if(not upstream_run and not is_stale(stage, state)):
+						finished.add(name)
+					elif(dry_run):
+						print('would run', name, ' '.join(stage['command']))
+						would_run.add(name)
+						finished.add(name)
+					elif(touch):
+						state['stages'][name]=stage_record(stage, state['files'])
+						finished.add(name)
+						print('touched', name)
+					else:
+						print('running', name, ' '.join(stage['command']))
+						running[executor.submit(run_stage, stage)]=name
+
+			if(len(running)==0):
+				continue
+
+			done, not_done = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+
+			for future in done:
+				name=running.pop(future)
+
+				if(future.result()==0):
+					state['stages'][name]=stage_record(stage_dict[name], state['files'])
+					finished.add(name)
+					print('completed', name)
+				else:
+					state['stages'].pop(name, None)
+					failed.append(name)
+					print('failed', name)
+
+				save_state(state)
+
+	if(not dry_run):
+		save_state(state)
+
+	return failed
+
+def select_stages(stages, names):
+	'''
+	Returns the given stages and all the stages they depend on, in their declaration order.
+	'''
+
+	deps=dependencies(stages)
+
+	selected=set()
+	to_visit=list(names)
+
+	while(len(to_visit)>0):
+		name=to_visit.pop()
+		if(name not in selected):
+			selected.add(name)
+			to_visit+=list(deps[name])
+
+	return [stage for stage in stages if stage['name'] in selected]
+
+def run(names, jobs=None, dry_run=False, touch=False, threshold=None):
+	'''
+	Runs the given stages (all of them if no name is given) and the stages they depend on.
+	'''
+
+	if(threshold is None):
+		threshold=urban_threshold
+
+	if(threshold is None):
+		print('Urban threshold not set: the urban_rural stages are skipped and the existing _Urb_Rur.csv files are used')
+
+	stages=all_stages(threshold)
+
+	unknown=set(names)-{stage['name'] for stage in stages}
+	if(len(unknown)>0):
+		sys.exit('Unknown stages: '+', '.join(sorted(unknown)))
+
+	if(len(names)>0):
+		stages=select_stages(stages, names)
+
+	return run_pipeline(stages, jobs=jobs, dry_run=dry_run, touch=touch)
+
+if __name__ == '__main__':
+
+	import cli
+	cli.main(['run']+sys.argv[1:])
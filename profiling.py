@@ -0,0 +1,149 @@
+##########################################################################################################
+#
+# This module records a profile of a run of sample_PSU.py. For each (country, buffer, variable) stage,
+# optionally split into steps (e.g. reading the raster and the zonal sampling), it measures:
+#
+#	wall_s, cpu_s: wall time and CPU time, in seconds
+#	peak_rss_mb: peak resident memory of the process at the end of the stage
+#	peak_traced_mb: peak memory allocated by Python during the stage (only if tracemalloc is enabled)
+#	read_mb: data read by the process during the stage (from /proc/self/io, only on Linux)
+#	remote_calls, remote_s: number and total latency of the Google Earth Engine round trips
+#
+# together with the counts (e.g. polygons, pixels) provided by the script. The profile can be saved to
+# JSON and CSV files.
+#
+##########################################################################################################
+
+import os
+import time
+import json
+import resource
+import tracemalloc
+import pandas as pd
+
+records=[] # Completed stages
+current=None # Stage being measured
+enabled=False
+
+def start(trace_memory=False):
+	'''
+	Enables the profiling. Tracing the Python allocations slows the run down and is therefore optional.
+	'''
+
+	global enabled
+
+	enabled=True
+
+	if(trace_memory):
+		tracemalloc.start()
+
+def read_bytes():
+	'''
+	Returns the number of bytes read by the process so far, or None if it is not available.
+	'''
+
+	try:
+		with open('/proc/self/io') as f:
+			for line in f:
+				if(line.startswith('rchar:')):
+					return int(line.split()[1])
+	except OSError:
+		return None
+
+def peak_rss_mb():
+
+	peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	# ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+	if(os.uname().sysname=='Darwin'):
+		return peak/2**20
+
+	return peak/2**10
+
+def stage_start(country, buffer_str, variable, step='', **counts):
+	'''
+	Starts measuring a stage, closing the previous one if it is still open.
+	'''
+
+	global current
+
+	if(not enabled):
+		return
+
+	if(current is not None):
+		stage_end()
+
+	if(tracemalloc.is_tracing()):
+		tracemalloc.reset_peak()
+
+	current={
+		'country': country,
+		'buffer': buffer_str,
+		'variable': variable,
+		'step': step,
+		'remote_calls': 0,
+		'remote_s': 0.0,
+		'_wall': time.perf_counter(),
+		'_cpu': time.process_time(),
+		'_read': read_bytes()
+		}
+	current.update(counts)
+
+def stage_end(**counts):
+	'''
+	Stops measuring the current stage and records it, together with the given counts.
+	'''
+
+	global current
+
+	if(not enabled or current is None):
+		return
+
+	record=current
+	current=None
+
+	record['wall_s']=time.perf_counter()-record.pop('_wall')
+	record['cpu_s']=time.process_time()-record.pop('_cpu')
+	record['peak_rss_mb']=peak_rss_mb()
+
+	if(tracemalloc.is_tracing()):
+		record['peak_traced_mb']=tracemalloc.get_traced_memory()[1]/2**20
+
+	start_read=record.pop('_read')
+	end_read=read_bytes()
+	if(start_read is not None and end_read is not None):
+		record['read_mb']=(end_read-start_read)/2**20
+
+	record.update(counts)
+	records.append(record)
+
+def get_info(ee_object):
+	'''
+	Calls getInfo() on a Google Earth Engine object, adding its latency to the current stage.
+	'''
+
+	start_time=time.perf_counter()
+	info=ee_object.getInfo()
+
+	if(enabled and current is not None):
+		current['remote_calls']+=1
+		current['remote_s']+=time.perf_counter()-start_time
+
+	return info
+
+def save(path):
+	'''
+	Saves the profile to the files [path].json and [path].csv.
+	'''
+
+	if(current is not None):
+		stage_end()
+
+	folder=os.path.dirname(path)
+	if(folder!=''):
+		os.makedirs(folder, exist_ok=True)
+
+	with open(path+'.json', 'w') as f:
+		json.dump(records, f, indent=1)
+
+	pd.DataFrame(records).to_csv(path+'.csv', index=False)
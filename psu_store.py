@@ -0,0 +1,166 @@
+##########################################################################################################
+#
+# python psu_store.py [--country COUNTRY_STRING ...] [--buffers BUFFER ...]
+#
+# This module is a GeoParquet store of the PSU shapefiles (GIS/[COUNTRY_ACRONYM]/[COUNTRY_ACRONYM]_R8_PSU_*.shp).
+# Each shapefile is converted once to two GeoParquet files next to it:
+#
+#	[SHAPEFILE]_native.parquet: the geometries in the CRS of the shapefile
+#	[SHAPEFILE]_4326.parquet: the geometries in EPSG:4326
+#
+# with the bounds of each geometry (minx, miny, maxx, maxy, in the same CRS) and the EA_Num attribute as an
+# int64 index. The sizes, modification times and hash of the shapefile files are recorded in
+# [SHAPEFILE]_store.json: when the shapefile changes, the GeoParquet files are rebuilt the next time they
+# are loaded. Use load() instead of gpd.read_file() in the scripts and notebooks, e.g.
+#
+#	buffers = psu_store.load('GIS/KEN/KEN_R8_PSU_5km_buffers', crs='4326')
+#
+# The files are written to temporary files and renamed, so that the scripts run in parallel by pipeline.py
+# can load the same shapefile. Running the script (or "python cli.py store") builds the store in advance for
+# the selected countries and spatial units (same --buffers values as sample_PSU.py, default: poly km
+# percent); pipeline.py does so in the store stage, before the stages loading the shapefiles.
+#
+##########################################################################################################
+
+import os
+import sys
+import json
+import hashlib
+
+country_codes={'kenya': 'KEN', 'nigeria': 'NIG', 'ethiopia': 'ETH', 'southafrica': 'SAF'}
+
+shapefile_exts=['.shp', '.dbf', '.prj']
+store_crss=['native', '4326']
+bounds_columns=['minx', 'miny', 'maxx', 'maxy']
+
+def shapefile_hash(path):
+	'''
+	Returns the SHA-256 hash of the geometry (.shp), attribute (.dbf) and projection (.prj) files of a
+	shapefile (path without extension).
+	'''
+
+	digest=hashlib.sha256()
+
+	for ext in shapefile_exts:
+		if(os.path.exists(path+ext)):
+			with open(path+ext, 'rb') as f:
+				for block in iter(lambda: f.read(2**20), b''):
+					digest.update(block)
+
+	return digest.hexdigest()
+
+def shapefile_stats(path):
+
+	return {ext: [os.path.getsize(path+ext), os.path.getmtime(path+ext)] for ext in shapefile_exts if os.path.exists(path+ext)}
+
+def store_file(path, crs):
+
+	return path+'_'+crs+'.parquet'
+
+def write_replace(file, write):
+	'''
+	Writes a file with write(temporary_path) to a temporary file of the same directory, then renames it, so
+	that the processes reading the store at the same time never see a partial file.
+	'''
+
+	temp_file=file+'.'+str(os.getpid())+'.tmp'
+	write(temp_file)
+	os.replace(temp_file, file)
+
+def write_record(path, record):
+
+	def write(temp_file):
+		with open(temp_file, 'w') as f:
+			json.dump(record, f, indent=1)
+
+	write_replace(path+'_store.json', write)
+
+def is_fresh(path):
+	'''
+	Checks whether the GeoParquet files of a shapefile are up to date. The shapefile is only hashed if the
+	sizes or modification times of its files have changed; if the hash is the same, the new sizes and
+	times are recorded.
+	'''
+
+	record_file=path+'_store.json'
+
+	if(not os.path.exists(record_file) or not all(os.path.exists(store_file(path, crs)) for crs in store_crss)):
+		return False
+
+	with open(record_file) as f:
+		record=json.load(f)
+
+	stats=shapefile_stats(path)
+	if(record['stats']==json.loads(json.dumps(stats))):
+		return True
+
+	if(record['hash']!=shapefile_hash(path)):
+		return False
+
+	record['stats']=stats
+	write_record(path, record)
+
+	return True
+
+def build(path):
+	'''
+	Converts a shapefile (path without extension) to the native and EPSG:4326 GeoParquet files.
+	'''
+
+	import geopandas as gpd
+
+	polygons=gpd.read_file(path+'.shp')
+
+	if('EA_Num' in polygons.columns):
+		polygons['EA_Num']=polygons['EA_Num'].astype('int64')
+		polygons=polygons.set_index('EA_Num')
+
+	for crs in store_crss:
+
+		if(crs!='native'):
+			polygons=polygons.to_crs(epsg=int(crs))
+
+		polygons[bounds_columns]=polygons.geometry.bounds
+		write_replace(store_file(path, crs), polygons.to_parquet)
+
+	# Recorded last, so that the store is only fresh once both files are complete
+	write_record(path, {'hash': shapefile_hash(path), 'stats': shapefile_stats(path)})
+
+def load(path, crs='native', columns=None):
+	'''
+	Loads a shapefile (path without extension) from the store, in its native CRS or in EPSG:4326
+	(crs='4326'), building or rebuilding the GeoParquet files if needed. Only the given columns (and the
+	geometries) are read if columns is provided.
+	'''
+
+	import geopandas as gpd
+
+	if(not is_fresh(path)):
+		build(path)
+
+	if(columns is not None):
+		columns=list(columns)+['geometry']
+
+	return gpd.read_parquet(store_file(path, crs), columns=columns)
+
+def run(countries, buffer_strs):
+
+	from sample_PSU import buffer_file_name
+
+	for country in countries:
+
+		country_code=country_codes[country]
+
+		for buffer_str in buffer_strs:
+
+			path='GIS/'+country_code+'/'+buffer_file_name(country_code, buffer_str)
+
+			if(is_fresh(path)):
+				print(country, buffer_str, 'up to date')
+			else:
+				build(path)
+				print(country, buffer_str, 'built')
+
+if __name__ == '__main__':
+	import cli
+	cli.main(['store']+sys.argv[1:])
@@ -1,56 +1,60 @@
 ##########################################################################################################
 #
-# python sample_PSU.py [-k] [-p] 
+# python sample_PSU.py [--country COUNTRY_STRING ...] [--buffers BUFFER ...] [--variables VARIABLE ...]
+#                      [--workers WORKERS] [--profile] [--tracemalloc] [--cprofile]
 #
 # This script samples the PSU level variables (except for the ecological zones and the urban/rural binary)
-# over the four countries, saving the result to a CSV file.
+# over the four countries, saving the result to a CSV file. It is equivalent to "python cli.py sample".
 #
-# Depending on the arguments provided to the script in the command line, the operation can be performed
-# over different spatial units:
+# The command line arguments select what is sampled (by default, everything over the PSU polygons):
 #
-# 	no arguments: the operation is performed with the PSU polygons
-#	
-#	-k: the script loops over the fixed-distance buffers
+#	--country: the countries to process (default: all four)
 #
-#	-p: the script loops over the percent-area buffers 
+#	--buffers: the spatial units; "poly" for the PSU polygons (default), "km" for all the fixed-distance
+#	           buffers, "percent" for all the percent-area buffers, or single buffers (e.g. "5km", "200")
 #
-# This script uses the Google Earth Engine Python API and thus requires a GEE account. 
-# As uploading the spatial unit shapefiles through the script would be too time-consuming, you should
-# upload them manually before running this code (look for them in the GIS subfolders). Then, set your GEE 
-# path here below:
+#	--variables: the variables to sample among nighttime, LST_anoms, NDVI_anoms, rfe_anoms and Events
+#	             (default: all). If the output CSV file already exists, only the columns of these
+#	             variables are replaced.
+#
+#	--workers: number of processes computing the zonal means of the rainfall and ACLED variables (default: 1).
+#	           The rasters are shared with the processes through memory-mapped files (see parallel_zonal.py).
+#
+# The sampled variables are also saved to the long-format feature store of all the countries and spatial
+# units (see feature_store.py).
+#
+# The rainfall and ACLED variables are sampled over the simplified geometries created by simplify_PSU.py,
+# when they are up to date with the shapefiles.
+#
+# The backends are only imported when needed: a run that does not sample nighttime, LST_anoms or NDVI_anoms
+# never imports nor authenticates to Google Earth Engine.
+#
+# The following flags record a profile of the run (see profiling.py) in the Profiles/ folder:
+#
+#	--profile: saves the time, memory, data read and Earth Engine latency of each country, buffer and
+#	           variable to Profiles/sample_PSU_[TIMESTAMP].json and .csv
+#
+#	--tracemalloc: also traces the peak memory allocated by Python in each stage (slower)
+#
+#	--cprofile: also saves the cProfile statistics of the whole run to Profiles/sample_PSU_[TIMESTAMP].prof
+#
+# The nighttime, LST_anoms and NDVI_anoms variables use the Google Earth Engine Python API and thus require
+# a GEE account. As uploading the spatial unit shapefiles through the script would be too time-consuming,
+# you should upload them manually before running this code (look for them in the GIS subfolders). Then,
+# set your GEE path here below (e.g. 'projects/[YOUR_PROJECT]/assets/'):
+#
+GEE_path = ''
 #
-GEE_path =
-# 
 ##########################################################################################################
 
+import os
 import sys
-import ee
 import numpy as np
 import pandas as pd
-import geopandas as gpd
-import netCDF4
-import rasterio
-from scipy.stats import gaussian_kde
-from shapely.geometry import mapping
-from datetime import datetime, date, timedelta
-from rasterio.transform import from_origin, rowcol
-from rasterio.features import geometry_mask
-import time
-
-# Reading command line arguments
-arg_len = len(sys.argv)
-
-poly_buffer=False
-if(arg_len==1):
-	poly_buffer=True
-elif(sys.argv[1]=="-p"):
-	percent_buffer=True
-elif(sys.argv[1]=="-k"):
-	percent_buffer=False
-
-# Triggering the Google Earth Engine authentication flow
-ee.Authenticate()
-ee.Initialize()
+from datetime import datetime, date
+import profiling
+import psu_store
+import feature_store
 
 win_len=2 # Time interval (in years) considered for the variables
 lta_start=2000 # Start of the long-term average
@@ -58,7 +62,7 @@ lta_start=2000 # Start of the long-term average
 country_codes={'kenya': 'KEN', 'nigeria': 'NIG', 'ethiopia': 'ETH', 'southafrica': 'SAF'}
 country_names={'kenya': 'Kenya', 'nigeria': 'Nigeria', 'ethiopia': 'Ethiopia', 'southafrica': 'South Africa'}
 
-# Temporal coordinates of the Afrobarometer coordinates 
+# Temporal coordinates of the Afrobarometer coordinates
 country_years={'kenya': 2019, 'nigeria': 2020, 'ethiopia': 2019, 'southafrica': 2021}
 country_months={'kenya': 8, 'nigeria': 1, 'ethiopia': 12, 'southafrica': 4}
 
@@ -66,365 +70,548 @@ country_months={'kenya': 8, 'nigeria': 1, 'ethiopia': 12, 'southafrica': 4}
 percents=[200,300,400,500,750,1000]
 kms=[1,2,5,10,20,50]
 
-if(poly_buffer):
-	buffer_strs=['poly']
-elif(percent_buffer):
-	buffer_strs=[str(percent) for percent in percents]
-else:
-	buffer_strs=[str(km)+'km' for km in kms]
-
-# Looping over the countries
-for country in list(country_codes.keys()):
-
-	# Looping over the buffers
-	for buffer_str in buffer_strs:
-	
-		print(country, buffer_str)
-
-		country_code=country_codes[country]
-		country_year=country_years[country]
-		country_month=country_months[country]
-		country_name=country_names[country]
-		month_start = (country_month % 12) + 1
-		year_start = country_year - (country_month!=12) - (win_len-1)
-
-		buff_folder = 'GIS/'+country_code+'/'
-		dest_folder = 'Afrobarometer/'+country_code+'/'
-		
-		# Reading the shapefile 
-		if(poly_buffer):
-			buffer_file=country_code+'_R8_PSU_polys'
-		else:
-			buffer_file=country_code+'_R8_PSU_'+buffer_str+'_buffers'
+# Variables, in the order of the columns of the output files, and those retrieved from Google Earth Engine
+variables=['nighttime', 'LST_anoms', 'NDVI_anoms', 'rfe_anoms', 'Events']
+ee_variables=['nighttime', 'LST_anoms', 'NDVI_anoms']
+
+# MODIS anomaly variables: image collection, band and sampling scale (m) of the centroid fallback
+modis_products={
+	'LST_anoms': ('MODIS/061/MOD11A1', 'LST_Day_1km', 1000),
+	'NDVI_anoms': ('MODIS/061/MOD13Q1', 'NDVI', 250)
+	}
+
+ee_module=None
+
+def init_ee():
+	'''
+	Imports the Google Earth Engine API and initializes it with the stored credentials, the first time it is
+	called. The authentication flow is only triggered if there are no valid credentials and the script runs
+	in a terminal; otherwise (e.g. in the stages run by pipeline.py) an error is raised.
+	'''
+
+	global ee_module
+
+	if(ee_module is None):
+		import ee
+		try:
+			ee.Initialize()
+		except Exception:
+			if(not sys.stdin.isatty()):
+				raise RuntimeError('No valid Google Earth Engine credentials: run "earthengine authenticate" first')
+			ee.Authenticate()
+			ee.Initialize()
+		ee_module=ee
+
+	return ee_module
+
+def ee_sampler(image, band, scale, crs):
+	'''
+	Returns the function that is mapped over all the spatial unit polygons and finds the mean value of
+	the image band in each one.
+	'''
+
+	ee=init_ee()
+
+	def sampler(feature):
+
+		geom = ee.Feature(feature).geometry().transform(crs,ee.ErrorMargin(10))
+
+		meanDict2 = image.reduceRegion(reducer=ee.Reducer.mean(), geometry=geom)
+
+		value1=ee.Number(meanDict2.get(band))
+
+		centroid=geom.centroid(1)
+		sample_size = ee.Number(image.sample(centroid, scale).size())
+
+		# In case the polygon is too small to straddle a pixel, the nearest value to the centroid is used
+		value2 = ee.Algorithms.If(sample_size, ee.Number(image.sample(centroid, scale).first().get(band)), ee.Number(0))
+
+		return(ee.Algorithms.If(value1, value1, value2))
+
+	return sampler
+
+def sample_nighttime(buffer_file, country_year):
+	'''
+	Samples the VIIRS nighttime lights of the Afrobarometer year over the spatial units uploaded on GEE.
+	'''
+
+	ee=init_ee()
+
+	buffers_ee = ee.FeatureCollection(GEE_path+buffer_file) # Accessing the shapefile uploaded on GEE
+
+	dataset = ee.ImageCollection('NOAA/VIIRS/DNB/ANNUAL_V21').filter(ee.Filter.date(str(country_year)+'-01-01', str(country_year+1)+'-01-01'))
+
+	light_image = dataset.select('maximum').first()
+	crs = light_image.projection()
+
+	meanList=buffers_ee.toList(buffers_ee.size()).map(ee_sampler(light_image, 'maximum', 464, crs))
+
+	return list(profiling.get_info(meanList))
+
+def modis_anomaly_image(variable, year_start, month_start, window=win_len):
+	'''
+	Computes the standardized anomaly image of a MODIS product (see modis_products), averaging the images over
+	windows of window years (by default win_len) starting at month_start, up to the one starting at
+	(year_start, month_start). Returns the image and its projection.
+	'''
+
+	ee=init_ee()
+
+	collection, band, scale = modis_products[variable]
+
+	dataset = ee.ImageCollection(collection).select([band])
+	crs = dataset.first().projection()
+
+	date_list = ee.List([datetime(year, month_start, 1, 0, 0).strftime('%Y-%m-%d') for year in range(lta_start,year_start+1)])
+
+	# This function creates the bi-yearly means
+	def year_mapper(date_str):
+		startDate = ee.Date(date_str)
+		endDate = startDate.advance(window, 'year')
+		biYearlyCollection = dataset.filterDate(startDate, endDate)
+
+		biYearlyMean = biYearlyCollection.mean();
+
+		yearProperties = {
+		'system:time_start': startDate.millis(),
+		'system:time_end': endDate.millis()
+		}
+
+		return biYearlyMean.set(yearProperties)
+
+	yearAverages = ee.ImageCollection.fromImages(date_list.map(year_mapper))
+
+	# Long-term average and standard deviation
+
+	ltaDate1 = ee.Date(date_list.get(0))
+	ltaDate2 = ee.Date(date_list.reverse().get(0)).advance(-win_len+1, 'year')
+	ltaAverages = yearAverages.filterDate(ltaDate1, ltaDate2)
+
+	ltaMean = ltaAverages.mean()
+
+	ltaStd = ltaAverages.reduce(ee.Reducer.stdDev())
+
+	lastImg = yearAverages.sort('system:time_start',False).first()
+
+	resImg = lastImg.subtract(ltaMean)
+	anomImg = resImg.divide(ltaStd) # Standardized anomaly
 
-		buffers = gpd.read_file(buff_folder+buffer_file+'.shp')
+	return anomImg, crs
 
-		buffers['geometry'] = buffers['geometry'].to_crs(epsg=4326)
-		feat_num=len(buffers)
+def sample_modis_anomaly(buffer_file, variable, year_start, month_start):
+	'''
+	Samples the standardized anomaly of a MODIS product (see modis_products) over the spatial units
+	uploaded on GEE.
+	'''
+
+	ee=init_ee()
+
+	collection, band, scale = modis_products[variable]
+
+	buffers_ee = ee.FeatureCollection(GEE_path+buffer_file) # Accessing the shapefile uploaded on GEE
+
+	anomImg, crs = modis_anomaly_image(variable, year_start, month_start)
+
+	anomList=buffers_ee.toList(buffers_ee.size()).map(ee_sampler(anomImg, band, scale, crs))
+
+	return profiling.get_info(anomList)
+
+def rainfall_anomaly(nc_file_path, year_start, month_start):
+	'''
+	Computes the standardized anomaly of the rainfall over the win_len years starting at (year_start, month_start)
+	from the TAMSAT NetCDF file. Returns the anomaly raster and its transform.
+	'''
+
+	import netCDF4
+	from rasterio.transform import from_origin
+
+	nc = netCDF4.Dataset(nc_file_path, 'r')
+	time_values = nc.variables['time'][:]
+	year_values = np.array([date.fromtimestamp(time_value).year for time_value in time_values])
+	month_values = np.array([date.fromtimestamp(time_value).month for time_value in time_values])
+
+	lon = nc.variables['lon'][:]
+	lat = nc.variables['lat'][:]
+	pixel_size_x = abs(lon[1] - lon[0])
+	pixel_size_y = abs(lat[1] - lat[0])
+
+	# Choose the upper-left corner coordinates
+	upper_left_x = min(lon)
+	upper_left_y = max(lat)
+
+	transform = from_origin(upper_left_x, upper_left_y, pixel_size_x, pixel_size_y)
+
+	data_values = np.array(nc.variables['rfe'][:])
+	nc.close()
+
+	# Calculating the bi-yearly means
+
+	biYearly_rasters = np.zeros((year_start+1-lta_start,len(lat),len(lon)))
+
+	for year in range(lta_start,year_start+1):
+
+		time_mask = np.flatnonzero(np.logical_and(month_values==month_start, year_values==year))[0]+np.arange(win_len*12,dtype=int)
+
+		biYearly_raster = np.sum(data_values[time_mask,:,:], axis=0)
+
+		biYearly_rasters[year-lta_start,:,:]=biYearly_raster
+
+	# Calcuating the standardized anomaly
+	mean_raster = np.mean(biYearly_rasters[:-win_len,:,:], axis=0)
+	std_raster = np.std(biYearly_rasters[:-win_len,:,:], axis=0)
+
+	afb_raster = biYearly_rasters[-1,:,:]
+
+	anom_raster = (afb_raster - mean_raster)/std_raster
+
+	return anom_raster, transform
+
+def nearest_valid_index(raster):
+	'''
+	Returns the row and column indices of the nearest finite pixel of each pixel of the raster, computed
+	once for the whole raster with a Euclidean distance transform. Compute it once per raster and pass it to
+	zonal_means (or sample_zonal) for all the spatial units sampled over the raster.
+	'''
+
+	from scipy.ndimage import distance_transform_edt
+
+	return distance_transform_edt(~np.isfinite(raster), return_distances=False, return_indices=True)
+
+def nearest_values(polygons, raster, transform, nearest_index=None):
+	'''
+	Returns the value of the finite pixel nearest to the centroid of each polygon (centroids outside the
+	raster are moved to its edge). The values are NaN if the raster has no finite pixel. The nearest pixel
+	index (see nearest_valid_index) is only computed if it is not provided.
+	'''
+
+	import shapely
+	from rasterio.transform import rowcol
+
+	values=np.full(len(polygons), np.nan)
+
+	if(len(polygons)==0 or not np.isfinite(raster).any()):
+		return values
+
+	centroids=shapely.centroid(np.asarray(polygons))
+	rows, cols = rowcol(transform, shapely.get_x(centroids), shapely.get_y(centroids))
+	rows=np.clip(np.asarray(rows), 0, raster.shape[0]-1)
+	cols=np.clip(np.asarray(cols), 0, raster.shape[1]-1)
+
+	if(nearest_index is None):
+		nearest_index=nearest_valid_index(raster)
+
+	nearest_rows, nearest_cols = nearest_index
+
+	return raster[nearest_rows[rows,cols], nearest_cols[rows,cols]]
+
+def zonal_means(polygons, raster, transform, fallback=True, nearest_index=None):
+	'''
+	Finds the mean value of the finite pixels of the raster within each polygon. In case the polygon does
+	not cover any finite pixel (e.g. it is too small to straddle a pixel), the value of the finite pixel
+	nearest to its centroid is used, unless fallback is False (the value is then NaN).
+	'''
+
+	from rasterio.features import geometry_mask
+
+	values = np.full(len(polygons), np.nan)
+	invalid = ~np.isfinite(raster)
+
+	for index, polygon in enumerate(polygons):
+
+		poly_mask = geometry_mask([polygon], out_shape=raster.shape, transform=transform, invert=False)
+
+		masked_data = np.ma.masked_array(raster, poly_mask | invalid)
+		if(np.ma.count(masked_data)>0):
+			values[index]=np.ma.mean(masked_data)
+
+	if(fallback):
+		empty=np.flatnonzero(np.isnan(values))
+		values[empty]=nearest_values(np.asarray(polygons)[empty], raster, transform, nearest_index)
+
+	return values
+
+def sample_zonal(polygons, raster, transform, workers=1, nearest_index=None):
+	'''
+	Computes the zonal means, in parallel if more than one worker is requested.
+	'''
+
+	if(workers>1):
+		from parallel_zonal import parallel_zonal_means
+		return parallel_zonal_means(polygons, raster, transform, workers=workers, nearest_index=nearest_index)
+
+	return zonal_means(polygons, raster, transform, nearest_index=nearest_index)
+
+def buffer_strings(buffer_args):
+	'''
+	Expands the --buffers arguments ("poly", "km", "percent" or single buffers) into the list of buffer strings.
+	'''
+
+	buffer_strs=[]
+
+	for buffer_arg in buffer_args:
+		if(buffer_arg=='km'):
+			buffer_strs+=[str(km)+'km' for km in kms]
+		elif(buffer_arg=='percent'):
+			buffer_strs+=[str(percent) for percent in percents]
+		else:
+			buffer_strs.append(buffer_arg)
 
-		## NIGHTTIME LIGHTS
+	return list(dict.fromkeys(buffer_strs))
 
-		buffers_ee = ee.FeatureCollection(GEE_path+buffer_file) # Accessing the shapefile uploaded on GEE
+def buffer_file_name(country_code, buffer_str):
 
-		dataset = ee.ImageCollection('NOAA/VIIRS/DNB/ANNUAL_V21').filter(ee.Filter.date(str(country_year)+'-01-01', str(country_year+1)+'-01-01'))
+	if(buffer_str=='poly'):
+		return country_code+'_R8_PSU_polys'
 
-		light_image = dataset.select('maximum').first()
-		crs = light_image.projection()
+	return country_code+'_R8_PSU_'+buffer_str+'_buffers'
 
-		feature_num=buffers_ee.size()
+def simplified_geometries(shapefile_path, buffers, country):
+	'''
+	Returns the simplified geometries of the spatial units if their cache is up to date with the shapefile
+	and the rasters of the country (see simplify_PSU.py), the original ones otherwise.
+	'''
 
-		features=buffers_ee.toList(feature_num)
-		
-		# This function is mapped over all the spatial unit polygons and finds the mean value in each one
-		def sampler(feature):
+	from simplify_PSU import cached_simplified, country_grids
 
-			geom = ee.Feature(feature).geometry().transform(crs,ee.ErrorMargin(10))
+	cache_path=cached_simplified(shapefile_path, country_grids(country))
 
-			meanDict2 = light_image.reduceRegion(reducer=ee.Reducer.mean(), geometry=geom)
+	if(cache_path is not None):
+		simplified=psu_store.load(cache_path, crs='4326', columns=[])
+		if(np.array_equal(simplified.index.to_numpy(), buffers['EA_Num'].to_numpy())):
+			print('Using', cache_path)
+			return simplified.geometry.values
 
-			light_value1=ee.Number(meanDict2.get('maximum'))
+	return buffers['geometry'].values
 
-			centroid=geom.centroid(1)
-			sample_size = ee.Number(light_image.sample(centroid, 464).size())
+def save_variables(psu_df, out_file):
+	'''
+	Saves the sampled variables to the CSV file. If the file exists, the columns of the variables that were
+	not sampled are kept.
+	'''
 
-			light_value2 = ee.Algorithms.If(sample_size, ee.Number(light_image.sample(centroid, 464).first().get('maximum')), ee.Number(0))
+	if(os.path.exists(out_file)):
+		old_df=pd.read_csv(out_file, index_col=0)
+		old_df['EA_Num']=old_df['EA_Num'].astype('int64')
+		old_df=old_df.set_index('EA_Num').reindex(psu_df['EA_Num'])
 
-			return(ee.Algorithms.If(light_value1, light_value1, light_value2))
+		for column in psu_df.columns:
+			if(column!='EA_Num'):
+				old_df[column]=psu_df[column].to_numpy()
 
-		meanList=buffers_ee.toList(buffers_ee.size()).map(sampler)
+		psu_df=old_df.reset_index()
 
-		light_values = list(meanList.getInfo())
+	# Same column order as the files included in the repository
+	columns=[column for column in ['nighttime', 'EA_Num']+variables[1:] if column in psu_df.columns]
 
-		light_df = pd.DataFrame({'nighttime': light_values})
-		light_df['EA_Num']=buffers['EA_Num']
-		light_df['EA_Num']=light_df['EA_Num'].astype('int64')
-		
-		print('nighttime')
+	psu_df.loc[:,columns].to_csv(out_file)
 
-		## LAND SURFACE TEMPERATURE
+def run(countries, buffer_strs, selected_variables, workers=1, profile=False, trace_memory=False, cprofile=False):
+	'''
+	Samples the selected variables over the selected spatial units of the selected countries.
+	'''
 
-		temp_dataset = ee.ImageCollection('MODIS/061/MOD11A1').select(['LST_Day_1km'])
-		crs = temp_dataset.first().projection()
+	profile_path='Profiles/sample_PSU_'+datetime.now().strftime('%Y%m%d_%H%M%S')
 
-		first_date = datetime(year_start, month_start, 1, 0, 0)
+	if(profile or cprofile):
+		profiling.start(trace_memory=trace_memory)
 
-		date_list = ee.List([datetime(year, month_start, 1, 0, 0).strftime('%Y-%m-%d') for year in range(lta_start,year_start+1)])
+	if(cprofile):
+		import cProfile
+		profiler=cProfile.Profile()
+		profiler.enable()
 
-		# This function creates the bi-yearly means
-		def year_mapper(date_str):
-			startDate = ee.Date(date_str)
-			endDate = startDate.advance(win_len, 'year')
-			biYearlyCollection = temp_dataset.filterDate(startDate, endDate)
+	# Looping over the countries
+	for country in countries:
 
-			biYearlyMean = biYearlyCollection.mean();
+		# Rasters of the country and their nearest finite pixel index, computed once for all the spatial units
+		rasters={}
 
-			yearProperties = {
-			'system:time_start': startDate.millis(),
-			'system:time_end': endDate.millis()
-			}
+		# Looping over the buffers
+		for buffer_str in buffer_strs:
 
-			return biYearlyMean.set(yearProperties) 
+			print(country, buffer_str)
 
-		yearAverages = ee.ImageCollection.fromImages(date_list.map(year_mapper))
-		
-		# Long-term average and standard deviation
+			country_code=country_codes[country]
+			country_year=country_years[country]
+			country_month=country_months[country]
+			country_name=country_names[country]
+			month_start = (country_month % 12) + 1
+			year_start = country_year - (country_month!=12) - (win_len-1)
 
-		ltaDate1 = ee.Date(date_list.get(0))
-		ltaDate2 = ee.Date(date_list.reverse().get(0)).advance(-win_len+1, 'year')
-		ltaAverages = yearAverages.filterDate(ltaDate1, ltaDate2)
+			buff_folder = 'GIS/'+country_code+'/'
+			dest_folder = 'Afrobarometer/'+country_code+'/'
 
-		ltaMean = ltaAverages.mean()
+			# Reading the shapefile
+			buffer_file=buffer_file_name(country_code, buffer_str)
 
-		ltaStd = ltaAverages.reduce(ee.Reducer.stdDev())
+			profiling.stage_start(country, buffer_str, 'geometry', 'read')
 
-		lastImg = yearAverages.sort('system:time_start',False).first()
+			buffers = psu_store.load(buff_folder+buffer_file, crs='4326', columns=[]).reset_index()
+			feat_num=len(buffers)
 
-		resImg = lastImg.subtract(ltaMean)
-		anomImg = resImg.divide(ltaStd) # Standardized anomaly
-		
-		# This function is mapped over all the spatial unit polygons and finds the mean value in each one
-		def sampler(feature):
+			# Simplified geometries used for the rasterization (see simplify_PSU.py), if up to date
+			zonal_geoms=simplified_geometries(buff_folder+buffer_file, buffers, country)
 
-			geom = ee.Feature(feature).geometry().transform(crs,ee.ErrorMargin(10))
+			profiling.stage_end(polygons=feat_num)
 
-			meanDict2 = anomImg.reduceRegion(reducer=ee.Reducer.mean(), geometry=geom)
+			psu_df = pd.DataFrame({'EA_Num': buffers['EA_Num'].astype('int64')})
 
-			anom_value1=ee.Number(meanDict2.get('LST_Day_1km'))
+			## NIGHTTIME LIGHTS
 
-			centroid=geom.centroid(1)
-			sample_size = ee.Number(anomImg.sample(centroid, 1000).size())
-			
-			# In case the polygon is too small to straddle a pixel, the nearest value to the centroid is used
-			anom_value2 = ee.Algorithms.If(sample_size, ee.Number(anomImg.sample(centroid, 1000).first().get('LST_Day_1km')), ee.Number(0))
+			if('nighttime' in selected_variables):
 
-			return(ee.Algorithms.If(anom_value1, anom_value1, anom_value2))
+				profiling.stage_start(country, buffer_str, 'nighttime', 'remote', polygons=feat_num)
 
-		tempAnomList=buffers_ee.toList(buffers_ee.size()).map(sampler)
-		
-		tempAnom_values=tempAnomList.getInfo()
+				psu_df['nighttime']=sample_nighttime(buffer_file, country_year)
 
-		light_df['LST_anoms']=tempAnom_values
+				profiling.stage_end()
 
-		print('LST')
+				print('nighttime')
 
-		## VEGETATION
+			## LAND SURFACE TEMPERATURE AND VEGETATION
 
-		ndvi_dataset = ee.ImageCollection("MODIS/061/MOD13Q1").select(['NDVI'])
-		crs = ndvi_dataset.first().projection()
+			for variable in ['LST_anoms', 'NDVI_anoms']:
 
-		first_date = datetime(year_start, month_start, 1, 0, 0)
+				if(variable in selected_variables):
 
-		date_list = ee.List([datetime(year, month_start, 1, 0, 0).strftime('%Y-%m-%d') for year in range(lta_start,year_start+1)])
+					profiling.stage_start(country, buffer_str, variable, 'remote', polygons=feat_num)
 
-		# This function creates the bi-yearly means
-		def year_mapper(date_str):
-			startDate = ee.Date(date_str)
-			endDate = startDate.advance(win_len, 'year')
-			biYearlyCollection = ndvi_dataset.filterDate(startDate, endDate)
+					psu_df[variable]=sample_modis_anomaly(buffer_file, variable, year_start, month_start)
 
-			biYearlyMean = biYearlyCollection.mean();
+					profiling.stage_end()
 
-			yearProperties = {
-			'system:time_start': startDate.millis(),
-			'system:time_end': endDate.millis()
-			}
+					print(variable.split('_')[0])
 
-			return biYearlyMean.set(yearProperties) 
+			## RAINFALL
 
-		yearAverages = ee.ImageCollection.fromImages(date_list.map(year_mapper))
-		
-		# Long-term average and standard deviation
+			if('rfe_anoms' in selected_variables):
 
-		ltaDate1 = ee.Date(date_list.get(0))
-		ltaDate2 = ee.Date(date_list.reverse().get(0)).advance(-win_len+1, 'year')
-		ltaAverages = yearAverages.filterDate(ltaDate1, ltaDate2)
+				profiling.stage_start(country, buffer_str, 'rfe_anoms', 'raster')
 
-		ltaMean = ltaAverages.mean()
+				if('rfe_anoms' not in rasters):
 
-		ltaStd = ltaAverages.reduce(ee.Reducer.stdDev())
+					nc_file_path='TAMSAT/'+country+'_rainfall.nc'
 
-		lastImg = yearAverages.sort('system:time_start',False).first()
+					anom_raster, transform = rainfall_anomaly(nc_file_path, year_start, month_start)
+					rasters['rfe_anoms']=(anom_raster, transform, nearest_valid_index(anom_raster))
 
-		resImg = lastImg.subtract(ltaMean)
-		anomImg = resImg.divide(ltaStd) # Standardized anomaly
+				anom_raster, transform, nearest_index = rasters['rfe_anoms']
 
-		# This function is mapped over all the spatial unit polygons and finds the mean value in each one
-		def sampler(feature):
+				profiling.stage_start(country, buffer_str, 'rfe_anoms', 'zonal', polygons=feat_num, pixels=anom_raster.size)
 
-			geom = ee.Feature(feature).geometry().transform(crs,ee.ErrorMargin(10))
+				# Finding the mean values within each polygon
+				psu_df['rfe_anoms'] = sample_zonal(zonal_geoms, anom_raster, transform, workers, nearest_index)
 
-			meanDict2 = anomImg.reduceRegion(reducer=ee.Reducer.mean(), geometry=geom)
+				profiling.stage_end()
 
-			anom_value1=ee.Number(meanDict2.get('NDVI'))
+				print('RFE')
 
-			centroid=geom.centroid(1)
-			sample_size = ee.Number(anomImg.sample(centroid, 250).size())
+			## ACLED
 
-			# In case the polygon is too small to straddle a pixel, the nearest value to the centroid is used 
-			anom_value2 = ee.Algorithms.If(sample_size, ee.Number(anomImg.sample(centroid, 250).first().get('NDVI')), ee.Number(0))
+			# Code to create the ACLED kernel density and map them to TIF files
+			'''
+			import rasterio
+			import geopandas as gpd
+			from scipy.stats import gaussian_kde
+			from rasterio.transform import from_origin
 
+			acled_file='ACLED/2017-01-01-2024-03-05-Ethiopia-Kenya-Nigeria-South_Africa.csv'
 
-			return ee.Algorithms.If(anom_value1, anom_value1, anom_value2)
+			acled_df=pd.read_csv(acled_file)
 
-		ndviAnomList=buffers_ee.toList(buffers_ee.size()).map(sampler)
+			acled_df=acled_df.loc[acled_df['country']==country_name]
+			acled_df['datetime']=pd.to_datetime(acled_df['event_date'], format='%d %B %Y')
 
-		ndviAnom_values=ndviAnomList.getInfo()
+			year_end = year_start + win_len
+			start_date=datetime(year_start, month_start, 1,0,0,0)
+			end_date=datetime(year_end, month_start, 1,0,0,0)
 
-		light_df['NDVI_anoms']=ndviAnom_values
+			acled_df = acled_df.loc[(acled_df['datetime'] >= start_date) & (acled_df['datetime'] < end_date),:]
 
-		print('NDVI')
+			acled_df=acled_df.loc[acled_df['sub_event_type']!="Peaceful protest"]
+			len_acled=len(acled_df)
 
-		## RAINFALL
+			acled_data=gpd.GeoDataFrame(acled_df,geometry=gpd.points_from_xy(acled_df['longitude'],acled_df['latitude']), crs='EPSG:4326')
 
-		nc_file_path='TAMSAT/'+country+'_rainfall.nc'
+			# Extract the coordinates from the GeoDataFrame
+			x = acled_data.geometry.x
+			y = acled_data.geometry.y
 
-		nc = netCDF4.Dataset(nc_file_path, 'r')
-		time_values = nc.variables['time'][:]
-		year_values = np.array([date.fromtimestamp(time_value).year for time_value in time_values])
-		month_values = np.array([date.fromtimestamp(time_value).month for time_value in time_values])
+			# Set up raster grid parameters
+			resolution = 8.98E-3 # About 1 km; adjust as needed
+			grid_y, grid_x = np.mgrid[lower_right_y:upper_left_y:resolution, upper_left_x:lower_right_x:resolution]
+			grid_points = np.vstack([grid_x.ravel(), grid_y.ravel()])
 
-		lon = nc.variables['lon'][:]
-		lat = nc.variables['lat'][:]
-		pixel_size_x = abs(lon[1] - lon[0])
-		pixel_size_y = abs(lat[1] - lat[0])
+			# Calculate the kernel density estimate
+			kde = gaussian_kde(np.vstack([x,y]), bw_method='scott')
+			density = kde(grid_points)
 
-		# Choose the upper-left corner coordinates
-		upper_left_x = min(lon)
-		upper_left_y = max(lat)
+			# Reshape the density values to match the grid shape
+			density_grid = np.flip(np.reshape(density, grid_x.shape), axis=0)
 
-		transform = from_origin(upper_left_x, upper_left_y, pixel_size_x, pixel_size_y)
+			# Define spatial information (transform and CRS)
+			transform = from_origin(upper_left_x, upper_left_y, resolution, resolution)  # Adjust according to your grid
+			crs = acled_data.crs
 
-		data_values = np.array(nc.variables['rfe'][:])
+			# Specify the output raster file name
+			output_raster = "ACLED/"+country+"_ACLED.tif"
 
-		# Calculating the bi-yearly means
+			# Write the density map to a raster file
+			with rasterio.open(
+			    output_raster,
+			    "w",
+			    driver="GTiff",
+			    width=density_grid.shape[1],
+			    height=density_grid.shape[0],
+			    count=1,
+			    dtype=np.float32,
+			    crs=crs,
+			    transform=transform,
+			) as dst:
+			    dst.write(density_grid, 1)
 
-		biYearly_rasters = np.zeros((year_start+1-lta_start,len(lat),len(lon)))
+			print("Density map raster created successfully:", output_raster)
+			'''
 
-		for year in range(lta_start,year_start+1):
-		    
-			time_mask = np.flatnonzero(np.logical_and(month_values==month_start, year_values==year))[0]+np.arange(win_len*12,dtype=int)
+			if('Events' in selected_variables):
 
-			biYearly_raster = np.sum(data_values[time_mask,:,:], axis=0)
+				import rasterio
 
-			biYearly_rasters[year-lta_start,:,:]=biYearly_raster
+				# Code to compute the ACLED variable
+				profiling.stage_start(country, buffer_str, 'Events', 'raster')
 
-		# Calcuating the standardized anomaly
-		mean_raster = np.mean(biYearly_rasters[:-win_len,:,:], axis=0)
-		std_raster = np.std(biYearly_rasters[:-win_len,:,:], axis=0)
+				if('Events' not in rasters):
 
-		afb_raster = biYearly_rasters[-1,:,:]
+					acled_raster = "ACLED/"+country+"_ACLED.tif"
 
-		anom_raster = (afb_raster - mean_raster)/std_raster
-		    
-		# Finding the mean values within each polygon
-		rfe_anoms = np.zeros(feat_num)
-		    
-		for index,row in buffers.iterrows(): 
-			polygon = row['geometry']
-		    
-			poly_mask = geometry_mask([polygon], out_shape=(len(lat), len(lon)), transform=transform, invert=False)
+					with rasterio.open(acled_raster) as src:
+						transform = src.transform
+						acled_array = src.read(1, masked=True).astype(np.float64).filled(np.nan) # nodata pixels are skipped by zonal_means
 
-			masked_data = np.ma.masked_array(anom_raster, poly_mask)
-			if(np.ma.count(masked_data)==0):
-				row,col=rowcol(transform, polygon.centroid.x, polygon.centroid.y)
-				rfe_anoms[index]=np.nan_to_num(anom_raster[row,col], nan=0)
-			else:
-				rfe_anoms[index]=np.nanmean(masked_data)
-				
-			if(~np.isfinite(rfe_anoms[index])):
-				print(rfe_anoms[index])
-				rfe_anoms[index]=0
-		    
-		light_df['rfe_anoms']=rfe_anoms
-		
-		print('RFE')
+					rasters['Events']=(acled_array, transform, nearest_valid_index(acled_array))
 
-		## ACLED
-		
-		# Code to create the ACLED kernel density and map them to TIF files
-		'''
-		acled_file='ACLED/2017-01-01-2024-03-05-Ethiopia-Kenya-Nigeria-South_Africa.csv'
+				acled_array, transform, nearest_index = rasters['Events']
 
-		acled_df=pd.read_csv(acled_file)
+				profiling.stage_start(country, buffer_str, 'Events', 'zonal', polygons=feat_num, pixels=acled_array.size)
 
-		acled_df=acled_df.loc[acled_df['country']==country_name]
-		acled_df['datetime']=pd.to_datetime(acled_df['event_date'], format='%d %B %Y')
+				psu_df['Events'] = sample_zonal(zonal_geoms, acled_array, transform, workers, nearest_index)
 
-		year_end = year_start + win_len
-		start_date=datetime(year_start, month_start, 1,0,0,0)
-		end_date=datetime(year_end, month_start, 1,0,0,0)
+				profiling.stage_end()
 
-		acled_df = acled_df.loc[(acled_df['datetime'] >= start_date) & (acled_df['datetime'] < end_date),:]
+				print('ACLED')
 
-		acled_df=acled_df.loc[acled_df['sub_event_type']!="Peaceful protest"]
-		len_acled=len(acled_df)
+			save_variables(psu_df, dest_folder+country+'_vars_PSU_'+buffer_str+'_2.csv')
+			feature_store.write_features(psu_df, country, buffer_str)
 
-		acled_data=gpd.GeoDataFrame(acled_df,geometry=gpd.points_from_xy(acled_df['longitude'],acled_df['latitude']), crs='EPSG:4326')
+	if(cprofile):
+		profiler.disable()
+		os.makedirs('Profiles', exist_ok=True)
+		profiler.dump_stats(profile_path+'.prof')
 
-		# Extract the coordinates from the GeoDataFrame
-		x = acled_data.geometry.x
-		y = acled_data.geometry.y
+	if(profiling.enabled):
+		profiling.save(profile_path)
 
-		# Set up raster grid parameters
-		resolution = 8.98E-3 # About 1 km; adjust as needed
-		grid_y, grid_x = np.mgrid[lower_right_y:upper_left_y:resolution, upper_left_x:lower_right_x:resolution]
-		grid_points = np.vstack([grid_x.ravel(), grid_y.ravel()])
+if __name__ == '__main__':
 
-		# Calculate the kernel density estimate
-		kde = gaussian_kde(np.vstack([x,y]), bw_method='scott')
-		density = kde(grid_points)
-
-		# Reshape the density values to match the grid shape
-		density_grid = np.flip(np.reshape(density, grid_x.shape), axis=0)
-
-		# Define spatial information (transform and CRS)
-		transform = from_origin(upper_left_x, upper_left_y, resolution, resolution)  # Adjust according to your grid
-		crs = acled_data.crs
-
-		# Specify the output raster file name
-		output_raster = "ACLED/"+country+"_ACLED.tif"
-
-		# Write the density map to a raster file
-		with rasterio.open(
-		    output_raster,
-		    "w",
-		    driver="GTiff",
-		    width=density_grid.shape[1],
-		    height=density_grid.shape[0],
-		    count=1,
-		    dtype=np.float32,
-		    crs=crs,
-		    transform=transform,
-		) as dst:
-		    dst.write(density_grid, 1)
-
-		print("Density map raster created successfully:", output_raster)
-		'''
-		
-		# Code to compute the ACLED variable
-		acled_raster = "ACLED/"+country+"_ACLED.tif"
-
-		acled_counts = np.zeros(feat_num)
-
-		with rasterio.open(acled_raster) as src:
-			transform = src.transform
-			acled_array = src.read(1)
-
-			for index,row in buffers.iterrows(): 
-				polygon = row['geometry']
-
-				poly_mask = geometry_mask([polygon], out_shape=acled_array.shape, transform=transform, invert=False)
-
-				masked_data = np.ma.masked_array(acled_array, poly_mask)
-				if(np.ma.count(masked_data)==0):
-					row,col=rowcol(transform, polygon.centroid.x, polygon.centroid.y)
-					acled_counts[index]=np.nan_to_num(acled_array[row,col], nan=0)
-				else:
-					acled_counts[index]=np.nanmean(masked_data)
-
-		light_df['Events']=acled_counts
-		
-		print('ACLED')
-		
-		light_df.to_csv(dest_folder+country+'_vars_PSU_'+buffer_str+'_2.csv')
-		
+	import cli
+	cli.main(['sample']+sys.argv[1:])
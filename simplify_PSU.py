@@ -0,0 +1,267 @@
+##########################################################################################################
+#
+# python simplify_PSU.py [--country COUNTRY_STRING ...] [--buffers BUFFER ...] [--coverage-tolerance FRACTION]
+#
+# This script simplifies the PSU polygons and buffers before they are rasterized by sample_PSU.py. The
+# polygons (and especially the largest buffers) have far more vertices than the TAMSAT (~4 km) and ACLED
+# (~1 km) pixels can resolve, and every rasterization pays for them.
+#
+# The geometries are simplified in EPSG:4326 (the CRS in which they are rasterized) with a tolerance of
+# tolerance_fraction times the smallest pixel size of the country rasters. The pixel coverage of each
+# simplified geometry is then compared with the original one on every raster grid: where more than
+# --coverage-tolerance (default: 0, i.e. none) of the original pixels are changed, or the centroid of a
+# polygon covering no pixel moves to another pixel, the tolerance of that geometry is halved, up to
+# max_halvings times, after which the original geometry is kept.
+#
+# The simplified geometries are cached next to the original shapefile, in
+# GIS/[COUNTRY_ACRONYM]/[SHAPEFILE]_simplified.shp, together with a JSON report of the tolerances and of
+# the pixel coverage changes. sample_PSU.py uses them for the rainfall and ACLED variables as long as the
+# hash recorded in the report matches the original shapefile and the raster grids (transform and shape)
+# recorded in the report match the current rasters. They can also be uploaded to Google Earth Engine
+# instead of the originals to make the geometry transforms cheaper.
+#
+# The --buffers argument takes the same values as in sample_PSU.py (default: poly km percent).
+#
+##########################################################################################################
+
+import os
+import sys
+import json
+import numpy as np
+import shapely
+import psu_store
+
+country_codes={'kenya': 'KEN', 'nigeria': 'NIG', 'ethiopia': 'ETH', 'southafrica': 'SAF'}
+
+tolerance_fraction=0.25 # Simplification tolerance, as a fraction of the pixel size
+max_halvings=4 # Halvings of the tolerance of a geometry before keeping the original one
+
+def raster_files(country):
+	'''
+	Returns the rasters that the geometries of the country are sampled over.
+	'''
+
+	return ['TAMSAT/'+country+'_rainfall.nc', 'ACLED/'+country+'_ACLED.tif']
+
+def raster_grid(raster_file):
+	'''
+	Returns the transform and shape of the grid of a raster file (a TAMSAT NetCDF file or a GeoTIFF).
+	'''
+
+	if(raster_file.endswith('.nc')):
+		import netCDF4
+		from rasterio.transform import from_origin
+
+		with netCDF4.Dataset(raster_file, 'r') as nc:
+			lon = nc.variables['lon'][:]
+			lat = nc.variables['lat'][:]
+
+		# Same grid as sample_PSU.rainfall_anomaly
+		transform = from_origin(min(lon), max(lat), abs(lon[1] - lon[0]), abs(lat[1] - lat[0]))
+
+		return transform, (len(lat), len(lon))
+
+	import rasterio
+
+	with rasterio.open(raster_file) as src:
+		return src.transform, src.shape
+
+def country_grids(country):
+	'''
+	Returns the grids of the existing rasters of the country.
+	'''
+
+	return [raster_grid(raster_file) for raster_file in raster_files(country) if os.path.exists(raster_file)]
+
+def grid_record(transform, shape):
+	'''
+	Returns the JSON record of a grid (the 6 coefficients of the transform and the shape).
+	'''
+
+	return {'transform': [float(coef) for coef in list(transform)[:6]], 'shape': [int(size) for size in shape]}
+
+def pixel_window(bounds, transform, shape):
+	'''
+	Returns the (row_start, row_end, col_start, col_end) window of a north-up grid covering the bounds.
+	'''
+
+	min_x, min_y, max_x, max_y = bounds
+	col_start, row_start = ~transform*(min_x, max_y)
+	col_end, row_end = ~transform*(max_x, min_y)
+
+	return (max(int(np.floor(row_start)), 0), min(int(np.ceil(row_end)), shape[0]),
+		max(int(np.floor(col_start)), 0), min(int(np.ceil(col_end)), shape[1]))
+
+def coverage_changes(original, simplified, transform, shape):
+	'''
+	Counts, for each pair of geometries, the pixels of the grid covered by only one of the two, and the
+	pixels covered by the original geometry. Where the original geometry covers no pixel, a change of the
+	pixel containing the centroid (from which sample_PSU.zonal_means takes the nearest finite pixel instead)
+	counts as one changed pixel.
+	'''
+
+	from rasterio.features import geometry_mask
+	from rasterio.transform import rowcol
+	from rasterio.windows import Window, transform as window_transform
+
+	changed=np.zeros(len(original), dtype=int)
+	pixels=np.zeros(len(original), dtype=int)
+
+	bounds=np.column_stack([
+		np.minimum(shapely.bounds(original)[:,:2], shapely.bounds(simplified)[:,:2]),
+		np.maximum(shapely.bounds(original)[:,2:], shapely.bounds(simplified)[:,2:])
+		])
+
+	for index in range(len(original)):
+
+		row_start, row_end, col_start, col_end = pixel_window(bounds[index], transform, shape)
+
+		if(row_end>row_start and col_end>col_start):
+			win_transform=window_transform(Window(col_start, row_start, col_end-col_start, row_end-row_start), transform)
+			out_shape=(row_end-row_start, col_end-col_start)
+			original_mask=geometry_mask([original[index]], out_shape=out_shape, transform=win_transform, invert=True)
+			simplified_mask=geometry_mask([simplified[index]], out_shape=out_shape, transform=win_transform, invert=True)
+			pixels[index]=np.count_nonzero(original_mask)
+			changed[index]=np.count_nonzero(original_mask!=simplified_mask)
+
+		if(pixels[index]==0):
+			original_centroid=shapely.centroid(original[index])
+			simplified_centroid=shapely.centroid(simplified[index])
+			changed[index]+=int(rowcol(transform, original_centroid.x, original_centroid.y)!=rowcol(transform, simplified_centroid.x, simplified_centroid.y))
+
+	return changed, pixels
+
+def simplify_geometries(geoms, grids, coverage_tolerance=0):
+	'''
+	Simplifies the (EPSG:4326) geometries with a tolerance derived from the pixel size of the grids, halving
+	the tolerance of the geometries whose pixel coverage changes by more than coverage_tolerance (a fraction
+	of their pixels) on any grid. Returns the simplified geometries, their tolerances and, for each grid,
+	the changed and covered pixels.
+	'''
+
+	pixel_size=min(min(abs(transform.a), abs(transform.e)) for transform, shape in grids)
+
+	simplified=np.array(geoms, dtype=object)
+	tolerances=np.full(len(geoms), tolerance_fraction*pixel_size)
+	to_check=np.arange(len(geoms))
+
+	for halving in range(max_halvings+1):
+
+		simplified[to_check]=shapely.simplify(geoms[to_check], tolerances[to_check], preserve_topology=True)
+
+		exceeded=np.zeros(len(to_check), dtype=bool)
+		for transform, shape in grids:
+			changed, pixels = coverage_changes(geoms[to_check], simplified[to_check], transform, shape)
+			exceeded|=changed>coverage_tolerance*pixels
+
+		to_check=to_check[exceeded]
+		if(len(to_check)==0):
+			break
+
+		tolerances[to_check]/=2
+
+	# Keeping the original geometries that could not be simplified within the coverage tolerance
+	simplified[to_check]=geoms[to_check]
+	tolerances[to_check]=0
+
+	coverage=[coverage_changes(geoms, simplified, transform, shape) for transform, shape in grids]
+
+	return simplified, tolerances, coverage
+
+def simplified_file(shapefile_path):
+
+	return shapefile_path+'_simplified'
+
+def cached_simplified(shapefile_path, grids):
+	'''
+	Returns the path (without extension) of the simplified shapefile if it is up to date with the
+	original shapefile and was checked against the same raster grids, None otherwise.
+	'''
+
+	cache_path=simplified_file(shapefile_path)
+
+	if(not os.path.exists(cache_path+'.shp') or not os.path.exists(cache_path+'.json')):
+		return None
+
+	with open(cache_path+'.json') as f:
+		report=json.load(f)
+
+	if(report.get('source_hash')!=psu_store.shapefile_hash(shapefile_path)):
+		return None
+
+	# The pixel coverage only holds on the grids the geometries were checked against
+	cached_grids=[{'transform': grid.get('transform'), 'shape': grid.get('shape')} for grid in report.get('grids', [])]
+	if(cached_grids!=[grid_record(transform, shape) for transform, shape in grids]):
+		return None
+
+	return cache_path
+
+def simplify_shapefile(shapefile_path, grids, coverage_tolerance=0):
+	'''
+	Simplifies a shapefile (path without extension), saving the simplified shapefile and its report.
+	'''
+
+	import geopandas as gpd
+
+	polygons=psu_store.load(shapefile_path, crs='4326').reset_index().drop(columns=psu_store.bounds_columns)
+
+	geoms=np.asarray(polygons['geometry'].values)
+	simplified, tolerances, coverage = simplify_geometries(geoms, grids, coverage_tolerance)
+
+	vertices=shapely.get_num_coordinates(geoms)
+	simplified_vertices=shapely.get_num_coordinates(simplified)
+
+	polygons['geometry']=gpd.GeoSeries(simplified, index=polygons.index, crs='EPSG:4326')
+	polygons.to_file(simplified_file(shapefile_path)+'.shp')
+
+	report={
+		'source_hash': psu_store.shapefile_hash(shapefile_path),
+		'tolerance_fraction': tolerance_fraction,
+		'coverage_tolerance': coverage_tolerance,
+		'vertices': int(vertices.sum()),
+		'simplified_vertices': int(simplified_vertices.sum()),
+		'unsimplified': int(np.count_nonzero(tolerances==0)),
+		'grids': [dict(grid_record(transform, shape), **{
+			'pixel_size': [abs(transform.a), abs(transform.e)],
+			'changed_pixels': int(changed.sum()),
+			'covered_pixels': int(pixels.sum()),
+			'max_changed_fraction': float(np.max(changed/np.maximum(pixels, 1), initial=0))
+			}) for (transform, shape), (changed, pixels) in zip(grids, coverage)],
+		'polygons': [{
+			'EA_Num': int(ea_num),
+			'tolerance': float(tolerance),
+			'vertices': int(vertex_num),
+			'simplified_vertices': int(simplified_num),
+			'changed_pixels': [int(changed[index]) for changed, pixels in coverage]
+			} for index, (ea_num, tolerance, vertex_num, simplified_num) in enumerate(zip(polygons['EA_Num'], tolerances, vertices, simplified_vertices))]
+		}
+
+	with open(simplified_file(shapefile_path)+'.json', 'w') as f:
+		json.dump(report, f, indent=1)
+
+	return report
+
+def run(countries, buffer_strs, coverage_tolerance=0):
+
+	from sample_PSU import buffer_file_name
+
+	for country in countries:
+
+		country_code=country_codes[country]
+		grids=country_grids(country)
+
+		if(len(grids)==0):
+			print(country, 'skipped: no raster found')
+			continue
+
+		for buffer_str in buffer_strs:
+
+			shapefile_path='GIS/'+country_code+'/'+buffer_file_name(country_code, buffer_str)
+			report=simplify_shapefile(shapefile_path, grids, coverage_tolerance)
+
+			print(country, buffer_str, report['vertices'], '->', report['simplified_vertices'], 'vertices,',
+				', '.join(str(grid['changed_pixels'])+'/'+str(grid['covered_pixels']) for grid in report['grids']), 'pixels changed')
+
+if __name__ == '__main__':
+	import cli
+	cli.main(['simplify']+sys.argv[1:])
@@ -0,0 +1,267 @@
+##########################################################################################################
+#
+# python survey_stats.py [--country COUNTRY_STRING ...] [--by GROUP ...] [--weight WEIGHT]
+#                        [--replicates REPLICATES] [--seed SEED] [-o OUTPUT]
+#
+# This script computes the survey-weighted prevalence of the fear and experience outcomes (see the
+# OUTCOME_CODE glossary in the README) of the Afrobarometer respondents processed by afrobarometer.py,
+# per country and, optionally, per urban/rural PSU (Urb_Rur) or ecological zone (AEZ_Num), with cluster
+# bootstrap standard errors and 95% percentile intervals. The result is saved to
+# Results/weighted_prevalence.csv (or the -o file).
+#
+# The respondents are weighted by HH_weight (default) or EA_weight. The bootstrap resamples the PSUs (EA_Num)
+# within each country with the Rao-Wu rescaling: each replicate draws n-1 of the n PSUs of a country with
+# replacement and multiplies the weights of the drawn PSUs by n/(n-1) times the number of draws. All the
+# replicate weights are drawn as one (replicates x respondents) matrix, and all the replicates, groups and
+# outcomes are evaluated with a single sparse matrix product (in chunks of chunk_size replicates, to bound
+# the memory).
+#
+# The functions (group_index, weighted_means, weighted_crosstab, replicate_weights, bootstrap_means) can
+# also be used on their own, e.g. from a notebook.
+#
+##########################################################################################################
+
+import sys
+import numpy as np
+import pandas as pd
+
+country_acronyms={'nigeria': 'NIG', 'ethiopia': 'ETH', 'southafrica': 'SAF', 'kenya': 'KEN'}
+
+# Outcome variables and values for which they are set to 1 (as in the R scripts)
+outcome_values={'Q54aF': [1,2], 'Q54aE': [2], 'Q54bF': [1,2], 'Q54bE': [2], 'Q54cF': [1,2], 'Q54cE': [2]}
+
+# PSU level grouping variables and the files they are read from
+psu_groups={'Urb_Rur': '_Urb_Rur.csv', 'AEZ_Num': '_AEZ_PSU.csv'}
+
+replicates=2000 # Bootstrap replicates
+chunk_size=500 # Replicates evaluated at the same time
+alpha=0.05 # The intervals are at the 1-alpha level
+
+def load_respondents(countries, by=()):
+	'''
+	Reads the respondent data of the countries, adding the Country column and the PSU level grouping
+	variables in by, and the outcome indicators.
+	'''
+
+	dfs=[]
+
+	for country in countries:
+
+		folder='Afrobarometer/'+country_acronyms[country]+'/'
+
+		df=pd.read_csv(folder+country+'_afrob_vars.csv', index_col=0)
+		df['Country']=country
+
+		for group in by:
+			if(group in psu_groups):
+				psu_df=pd.read_csv(folder+country+psu_groups[group], index_col=0).loc[:,['EA_Num', group]]
+				df=df.merge(psu_df, on='EA_Num', how='left')
+
+		dfs.append(df)
+
+	df=pd.concat(dfs, ignore_index=True)
+
+	for outcome, values in outcome_values.items():
+		answers=df[outcome[:-1]]
+		df[outcome]=np.where(answers.isna(), np.nan, answers.isin(values).astype(float))
+
+	return df
+
+def group_index(df, by):
+	'''
+	Factorizes the combinations of the columns in by. Returns the group code of each row and the dataframe
+	of the group labels (one row per code).
+	'''
+
+	if(len(by)==0):
+		return np.zeros(len(df), dtype=np.int64), pd.DataFrame(index=[0])
+
+	groups=df.groupby(list(by), sort=True, dropna=True)
+
+	codes=groups.ngroup().fillna(-1).to_numpy(dtype=np.int64) # Rows with a missing group value are coded -1
+	labels=groups.size().index.to_frame(index=False)
+
+	return codes, labels
+
+def indicator_matrices(Y, codes, group_num):
+	'''
+	Returns the sparse (respondents x groups*outcomes) matrices whose products with a weight vector (or
+	matrix) give the weighted sums of the outcomes and the weighted counts of the valid answers of each
+	group. Rows with a missing group code (-1) are left out.
+	'''
+
+	from scipy.sparse import csr_matrix
+
+	resp_num, outcome_num = Y.shape
+	valid=~np.isnan(Y)
+	in_group=np.repeat(codes>=0, outcome_num)
+
+	rows=np.repeat(np.arange(resp_num), outcome_num)[in_group]
+	cols=(np.repeat(codes, outcome_num)*outcome_num+np.tile(np.arange(outcome_num), resp_num))[in_group]
+	shape=(resp_num, group_num*outcome_num)
+
+	sums=csr_matrix((np.nan_to_num(Y).ravel()[in_group], (rows, cols)), shape=shape)
+	counts=csr_matrix((valid.ravel()[in_group].astype(float), (rows, cols)), shape=shape)
+
+	return sums, counts
+
+def weighted_means(Y, weights, codes, group_num):
+	'''
+	Computes the weighted mean of each column of Y (respondents x outcomes, NaN for missing answers)
+	within each group. Returns a (groups x outcomes) array.
+	'''
+
+	Y=np.asarray(Y, dtype=float).reshape(len(weights), -1)
+	sums, counts = indicator_matrices(Y, codes, group_num)
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		means=(sums.T@weights)/(counts.T@weights)
+
+	return means.reshape(group_num, Y.shape[1])
+
+def weighted_crosstab(df, row, col, weight='HH_weight', normalize='index', row_index=None, col_index=None):
+	'''
+	Weighted cross-tabulation of two columns, normalized over the rows ('index'), the columns ('columns'),
+	everything ('all') or not at all (None). The group indices of the two columns (the codes and labels
+	returned by group_index) can be passed with row_index and col_index, to avoid recomputing them at each
+	call.
+	'''
+
+	row_codes, row_labels = row_index if row_index is not None else group_index(df, [row])
+	col_codes, col_labels = col_index if col_index is not None else group_index(df, [col])
+
+	weights=df[weight].to_numpy(dtype=float)
+	valid=(col_codes>=0) & ~np.isnan(weights)
+
+	# One indicator column per column group, summed per row group as the outcomes of weighted_means
+	Y=np.zeros((len(df), len(col_labels)))
+	Y[np.flatnonzero(valid), col_codes[valid]]=1
+
+	sums, counts = indicator_matrices(Y, np.where(valid, row_codes, -1), len(row_labels))
+	table=(sums.T@np.where(valid, weights, 0)).reshape(len(row_labels), len(col_labels))
+
+	if(normalize=='index'):
+		table=table/table.sum(axis=1, keepdims=True)
+	elif(normalize=='columns'):
+		table=table/table.sum(axis=0, keepdims=True)
+	elif(normalize=='all'):
+		table=table/table.sum()
+
+	return pd.DataFrame(table, index=pd.Index(row_labels[row].to_numpy(), name=row), columns=pd.Index(col_labels[col].to_numpy(), name=col))
+
+def cluster_index(clusters, strata):
+	'''
+	Factorizes the (stratum, cluster) pairs. Returns the cluster code of each respondent and the stratum
+	code of each cluster.
+	'''
+
+	groups=pd.DataFrame({'stratum': strata, 'cluster': clusters}).groupby(['stratum', 'cluster'], sort=True)
+
+	cluster_codes=groups.ngroup().to_numpy()
+	cluster_strata=pd.factorize(groups.size().index.get_level_values('stratum'))[0]
+
+	return cluster_codes, cluster_strata
+
+def replicate_weights(weights, cluster_codes, cluster_strata, replicate_num, rng):
+	'''
+	Draws the (replicates x respondents) matrix of Rao-Wu rescaled bootstrap weights, resampling the
+	clusters within each stratum (see cluster_index).
+	'''
+
+	multipliers=np.zeros((replicate_num, len(cluster_strata)))
+
+	for stratum in range(cluster_strata.max()+1):
+
+		stratum_clusters=np.flatnonzero(cluster_strata==stratum)
+		cluster_num=len(stratum_clusters)
+
+		if(cluster_num<2):
+			multipliers[:,stratum_clusters]=1
+			continue
+
+		draws=rng.multinomial(cluster_num-1, np.full(cluster_num, 1/cluster_num), size=replicate_num)
+		multipliers[:,stratum_clusters]=draws*cluster_num/(cluster_num-1)
+
+	return multipliers[:,cluster_codes]*weights
+
+def bootstrap_means(Y, weights, codes, group_num, clusters, strata, replicate_num=replicates, seed=None):
+	'''
+	Computes the weighted means of the columns of Y within each group for all the bootstrap replicates.
+	Returns a (replicates x groups x outcomes) array.
+	'''
+
+	rng=np.random.default_rng(seed)
+
+	Y=np.asarray(Y, dtype=float).reshape(len(weights), -1)
+	sums, counts = indicator_matrices(Y, codes, group_num)
+	cluster_codes, cluster_strata = cluster_index(clusters, strata)
+
+	estimates=np.empty((replicate_num, group_num*Y.shape[1]))
+
+	for start in range(0, replicate_num, chunk_size):
+
+		end=min(start+chunk_size, replicate_num)
+		W=replicate_weights(weights, cluster_codes, cluster_strata, end-start, rng)
+
+		with np.errstate(invalid='ignore', divide='ignore'):
+			estimates[start:end]=(sums.T@W.T).T/(counts.T@W.T).T
+
+	return estimates.reshape(replicate_num, group_num, Y.shape[1])
+
+def prevalence(df, by=('Country',), weight='HH_weight', replicate_num=replicates, seed=None):
+	'''
+	Returns the weighted prevalence of the outcomes in each group, with the bootstrap standard errors and
+	percentile intervals, the number of respondents and the number of PSUs.
+	'''
+
+	outcomes=list(outcome_values.keys())
+	df=df.loc[df[weight].notna()]
+
+	# The respondents without PSU cannot be resampled with their cluster (as in afrobarometer.ea_table)
+	no_psu=df['EA_Num'].isna()
+	if(no_psu.any()):
+		print('Warning:', int(no_psu.sum()), 'respondents without EA_Num left out')
+		df=df.loc[~no_psu]
+
+	codes, labels = group_index(df, by)
+	group_num=len(labels)
+
+	Y=df.loc[:,outcomes].to_numpy(dtype=float)
+	weights=df[weight].to_numpy(dtype=float)
+
+	means=weighted_means(Y, weights, codes, group_num)
+	boot=bootstrap_means(Y, weights, codes, group_num, df['EA_Num'].to_numpy(), df['Country'].to_numpy(), replicate_num, seed)
+
+	valid=codes>=0
+	respondents=np.bincount(codes[valid], minlength=group_num)
+	psus=df.loc[valid].groupby(codes[valid])['EA_Num'].nunique().reindex(range(group_num), fill_value=0).to_numpy()
+
+	results=[]
+
+	for index, outcome in enumerate(outcomes):
+		result=labels.copy()
+		result['Outcome']=outcome
+		result['Prevalence']=means[:,index]
+		result['SE']=np.nanstd(boot[:,:,index], axis=0, ddof=1)
+		result['CI_low']=np.nanquantile(boot[:,:,index], alpha/2, axis=0)
+		result['CI_high']=np.nanquantile(boot[:,:,index], 1-alpha/2, axis=0)
+		result['Respondents']=respondents
+		result['PSUs']=psus
+		results.append(result)
+
+	return pd.concat(results, ignore_index=True)
+
+def run(countries, by=('Country',), weight='HH_weight', replicate_num=replicates, seed=None, output='Results/weighted_prevalence.csv'):
+
+	by=list(dict.fromkeys(['Country']+list(by)))
+
+	df=load_respondents(countries, by)
+
+	results=prevalence(df, by, weight, replicate_num, seed)
+	results.to_csv(output, index=False)
+
+	print(results.to_string(index=False))
+
+if __name__ == '__main__':
+	import cli
+	cli.main(['stats']+sys.argv[1:])
@@ -0,0 +1,156 @@
+##########################################################################################################
+#
+# python urban_rural.py [--threshold THRESHOLD] [--country COUNTRY_STRING ...]
+#
+# This script computes the percentage of built area in each PSU polygon of the four countries from a local
+# built-up raster and classifies the PSUs as urban (1) or rural (0), replacing the ArcGIS/urban_rural.ipynb
+# notebook. The result is saved to a CSV file. If countries are provided with the --country argument, only
+# those countries are processed.
+#
+# A PSU is urban if its built area percentage is greater than or equal to the threshold, estimated in the
+# urb_rur.xlsx file, and Urb_Rur is left missing (with a warning) if the PSU covers no valid pixel of the
+# raster. Set the threshold here below or provide it with the --threshold command line argument:
+#
+urban_threshold = None
+#
+# The built-up raster is read from the path below. If built_class is set, the raster is treated as a land
+# cover map and the pixels of that class count as built (e.g. class 50 of ESA WorldCover); otherwise the
+# pixel values are treated as the built fraction of each pixel, between 0 and 1.
+#
+built_raster = 'Built/[COUNTRY_STRING]_built.tif'
+built_class = 50
+#
+##########################################################################################################
+
+import sys
+import numpy as np
+import pandas as pd
+import shapely
+import rasterio
+from rasterio.features import rasterize
+from rasterio.transform import rowcol, xy
+from rasterio.windows import Window, from_bounds, bounds as window_bounds
+import psu_store
+
+country_codes={'kenya': 'KEN', 'nigeria': 'NIG', 'ethiopia': 'ETH', 'southafrica': 'SAF'}
+
+chunk_size=4096 # Side (in pixels) of the chunks of the built-up raster read at once
+
+def built_percentages(polygons, raster_file, built_class=None):
+	'''
+	Returns the percentage of built area within each polygon (GeoSeries). The raster window covering the
+	polygons is read in chunks of chunk_size x chunk_size pixels: in each chunk, the polygons intersecting it
+	are burnt into a label raster (of the smallest integer type that fits) and the built pixels are summed
+	per label with np.bincount.
+	'''
+
+	feat_num=len(polygons)
+
+	built_sums=np.zeros(feat_num+1)
+	pixel_counts=np.zeros(feat_num+1, dtype=np.int64)
+
+	label_dtype=np.min_scalar_type(feat_num)
+
+	with rasterio.open(raster_file) as src:
+
+		polygons=polygons.to_crs(src.crs)
+		geoms=polygons.values
+		tree=shapely.STRtree(geoms)
+
+		# Window covering all the polygons
+		window=from_bounds(*polygons.total_bounds, transform=src.transform)
+		window=window.round_offsets().round_lengths().intersection(Window(0, 0, src.width, src.height))
+
+		row_start, col_start = int(window.row_off), int(window.col_off)
+		row_end, col_end = row_start+int(window.height), col_start+int(window.width)
+
+		for row_off in range(row_start, row_end, chunk_size):
+			for col_off in range(col_start, col_end, chunk_size):
+
+				chunk=Window(col_off, row_off, chunk_size, chunk_size).intersection(window)
+
+				indices=np.sort(tree.query(shapely.box(*window_bounds(chunk, src.transform)))) # In the burning order of the polygons
+				if(len(indices)==0):
+					continue
+
+				built_array=src.read(1, window=chunk, masked=True)
+				valid=~np.ma.getmaskarray(built_array)
+
+				# Label raster: 0 outside the polygons, index+1 inside the polygon with that index
+				labels=rasterize(
+					zip(geoms[indices], indices+1),
+					out_shape=built_array.shape,
+					transform=src.window_transform(chunk),
+					fill=0,
+					dtype=label_dtype
+					)
+
+				if(built_class is None):
+					valid&=np.isfinite(built_array.data)
+					built_values=built_array.data[valid]
+				else:
+					built_values=(built_array.data[valid]==built_class).astype(np.uint8)
+
+				built_sums+=np.bincount(labels[valid], weights=built_values, minlength=feat_num+1)
+				pixel_counts+=np.bincount(labels[valid], minlength=feat_num+1)
+
+		built_sums=built_sums[1:]
+		pixel_counts=pixel_counts[1:]
+
+		built_pct=np.full(feat_num, np.nan)
+		covered=pixel_counts>0
+		built_pct[covered]=100*built_sums[covered]/pixel_counts[covered]
+
+		# In case the polygon is too small to straddle a pixel, the value of the pixel containing the centroid
+		# (computed in a projected CRS) is used
+		small=np.flatnonzero(~covered)
+
+		if(len(small)>0):
+			small_polygons=polygons.iloc[small]
+			centroids=small_polygons.to_crs(small_polygons.estimate_utm_crs()).centroid.to_crs(src.crs)
+			rows, cols = rowcol(src.transform, centroids.x.to_numpy(), centroids.y.to_numpy())
+			rows=np.clip(np.asarray(rows), row_start, row_end-1)
+			cols=np.clip(np.asarray(cols), col_start, col_end-1)
+			xs, ys = xy(src.transform, rows, cols)
+
+			for index, value in zip(small, src.sample(zip(xs, ys), indexes=1, masked=True)):
+				if(not np.ma.is_masked(value[0])):
+					built_pct[index]=100*(float(value[0]) if built_class is None else float(value[0]==built_class))
+
+	return built_pct
+
+def run(countries, threshold=None):
+
+	if(threshold is None):
+		threshold=urban_threshold
+
+	if(threshold is None):
+		sys.exit('Set the urban threshold (see urb_rur.xlsx) in the script or with the --threshold argument')
+
+	# Looping over the countries
+	for country in countries:
+
+		print(country)
+
+		country_code=country_codes[country]
+
+		psus=psu_store.load('GIS/'+country_code+'/'+country_code+'_R8_PSU_polys', columns=[]).reset_index()
+
+		built_pct=built_percentages(psus.geometry, built_raster.replace('[COUNTRY_STRING]', country), built_class=built_class)
+
+		urb_df=pd.DataFrame({'EA_Num': psus['EA_Num'].astype('int64')})
+
+		# PSUs without built area percentage (outside the raster or on nodata pixels) are left missing
+		missing=np.isnan(built_pct)
+		urb_df['Urb_Rur']=pd.Series((built_pct>=threshold).astype(int), dtype='Int64').mask(missing)
+
+		if(missing.any()):
+			print('Warning:', np.count_nonzero(missing), 'PSUs without built area percentage, Urb_Rur left missing (EA_Num:',
+				', '.join(str(ea_num) for ea_num in urb_df.loc[missing, 'EA_Num'])+')')
+
+		urb_df.to_csv('Afrobarometer/'+country_code+'/'+country+'_Urb_Rur.csv')
+
+if __name__ == '__main__':
+
+	import cli
+	cli.main(['urban_rural']+sys.argv[1:])